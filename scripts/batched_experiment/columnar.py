@@ -0,0 +1,208 @@
+import array
+import bisect
+import mmap
+import os
+import pickle
+import struct
+import sys
+import uuid
+
+
+from batched_experiment.experiment_data import ExperimentResult, ExperimentResults, Result
+
+
+MAGIC = b'BXCOL001'
+_FOOTER_OFFSET = struct.Struct('<Q')
+# Per-result columns and their array type codes. Offsets have one more entry than there are results, so that the
+# values of result i are values[offsets[i]:offsets[i + 1]].
+_COLUMNS = (
+  ('batch', 'i'),
+  ('repetition', 'i'),
+  ('test', 'i'),
+  ('runner', 'i'),
+  ('throughput_offsets', 'q'),
+  ('fork_offsets', 'q'),
+  ('extra_offsets', 'q'),
+  ('throughput', 'd'),
+  ('fork_lengths', 'i'),
+  ('extras', 'B')
+)
+
+
+def _extras(result):
+  # Everything but the throughput and forks, pickled per result; most results only have execution data.
+  extras = (result.errors, result.execution, result.telemetry, result.metrics, result.metric_units, result.latency)
+  return pickle.dumps(extras, protocol=pickle.HIGHEST_PROTOCOL) if any(extras) else b''
+
+
+def write_columnar_results(experiment_results, path):
+  # Results are stored in the order of get_results, i.e. sorted by batch, test, runner and repetition, which the
+  # reader relies on to look up results by bisection.
+  results = experiment_results.get_results()
+  tests = sorted({result.test for result in results})
+  runners = sorted({result.runner for result in results})
+  test_ids = {test: i for i, test in enumerate(tests)}
+  runner_ids = {runner: i for i, runner in enumerate(runners)}
+  columns = {name: array.array(typecode) for name, typecode in _COLUMNS}
+  for name in ('throughput_offsets', 'fork_offsets', 'extra_offsets'):
+    columns[name].append(0)
+  test_rows = {}
+  for row, result in enumerate(results):
+    columns['batch'].append(result.batch)
+    columns['repetition'].append(result.repetition)
+    columns['test'].append(test_ids[result.test])
+    columns['runner'].append(runner_ids[result.runner])
+    columns['throughput'].extend(result.result.throughput)
+    columns['fork_lengths'].extend(len(fork) for fork in result.result.fork_throughput)
+    columns['extras'].frombytes(_extras(result.result))
+    columns['throughput_offsets'].append(len(columns['throughput']))
+    columns['fork_offsets'].append(len(columns['fork_lengths']))
+    columns['extra_offsets'].append(len(columns['extras']))
+    # Every test belongs to a single batch, so its results are contiguous.
+    first_row, _ = test_rows.get(test_ids[result.test], (row, row))
+    test_rows[test_ids[result.test]] = (first_row, row + 1)
+
+  with open(path, 'wb') as f:
+    f.write(MAGIC)
+    f.write(_FOOTER_OFFSET.pack(0))
+    column_locations = {}
+    for name, typecode in _COLUMNS:
+      # Columns are aligned to 8 bytes so that they can be cast in place.
+      f.write(b'\0' * (-f.tell() % 8))
+      column_locations[name] = (f.tell(), len(columns[name]))
+      columns[name].tofile(f)
+    footer_offset = f.tell()
+    pickle.dump(
+      {
+        'config': experiment_results.config,
+        # Identifies this write of the file, files rewritten in place get a new one.
+        'identifier': uuid.uuid4().hex,
+        'byteorder': sys.byteorder,
+        'tests': tests,
+        'runners': runners,
+        'test_rows': test_rows,
+        'columns': column_locations
+      },
+      f, protocol=pickle.HIGHEST_PROTOCOL
+    )
+    f.seek(len(MAGIC))
+    f.write(_FOOTER_OFFSET.pack(footer_offset))
+
+
+def is_columnar_file(path):
+  with open(path, 'rb') as f:
+    return f.read(len(MAGIC)) == MAGIC
+
+
+class ColumnarExperimentResults(ExperimentResults):
+  def __init__(self, path, identifier=None):
+    self.path = os.path.abspath(path)
+    with open(self.path, 'rb') as f:
+      self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if self._mmap[:len(MAGIC)] != MAGIC:
+      raise ValueError('{} is not a columnar experiment data file'.format(self.path))
+    footer_offset, = _FOOTER_OFFSET.unpack_from(self._mmap, len(MAGIC))
+    footer = pickle.loads(self._mmap[footer_offset:])
+    self.identifier = footer['identifier'] if 'identifier' in footer else None
+    if identifier is not None and identifier != self.identifier:
+      # E.g. by an incremental collection after statistics referring to it were computed.
+      raise ValueError('{} has been rewritten, results derived from it are out of date'.format(self.path))
+    super().__init__(footer['config'], None)
+    self._tests = footer['tests']
+    self._runners = footer['runners']
+    self._test_ids = {test: i for i, test in enumerate(self._tests)}
+    self._runner_ids = {runner: i for i, runner in enumerate(self._runners)}
+    self._test_rows = footer['test_rows']
+    self._columns = {}
+    for name, typecode in _COLUMNS:
+      offset, length = footer['columns'][name]
+      size = length * array.array(typecode).itemsize
+      if footer['byteorder'] == sys.byteorder:
+        self._columns[name] = memoryview(self._mmap)[offset:offset + size].cast(typecode)
+      else:
+        # Files written on a machine of the other byte order are converted in memory.
+        column = array.array(typecode, self._mmap[offset:offset + size])
+        column.byteswap()
+        self._columns[name] = column
+    self._rows = len(self._columns['batch'])
+    # Extras are unpickled straight from the mapping, which needs their position in the file.
+    self._extras_location = footer['columns']['extras'][0]
+
+  def __reduce__(self):
+    # Pickled, e.g. as part of ExperimentStatistics, by path only; the data is mapped again when unpickled, provided
+    # that the file has not been rewritten since.
+    return ColumnarExperimentResults, (self.path, self.identifier)
+
+  def _result(self, row):
+    columns = self._columns
+    throughput = array.array('d')
+    throughput.frombytes(memoryview(
+      columns['throughput'][columns['throughput_offsets'][row]:columns['throughput_offsets'][row + 1]]
+    ).cast('B'))
+    fork_lengths = columns['fork_lengths'][columns['fork_offsets'][row]:columns['fork_offsets'][row + 1]]
+    extra_start = columns['extra_offsets'][row]
+    extra_end = columns['extra_offsets'][row + 1]
+    result = Result(throughput=throughput, fork_lengths=fork_lengths.tolist())
+    if extra_end > extra_start:
+      (
+        result.errors, result.execution, result.telemetry, result.metrics, result.metric_units, result.latency
+      ) = pickle.loads(self._mmap[self._extras_location + extra_start:self._extras_location + extra_end])
+    return result
+
+  def _row_range(self, batch, test):
+    if test is not None:
+      if test not in self._test_ids:
+        return 0, 0
+      lo, hi = self._test_rows[self._test_ids[test]]
+      if batch is not None and self._columns['batch'][lo] != batch:
+        return 0, 0
+      return lo, hi
+    if batch is not None:
+      batches = self._columns['batch']
+      return bisect.bisect_left(batches, batch), bisect.bisect_right(batches, batch)
+    return 0, self._rows
+
+  def get_results(self, batch=None, repetition=None, test=None, runner=None, combine_repetitions=False):
+    if runner is not None and runner not in self._runner_ids:
+      return []
+    runner_id = self._runner_ids[runner] if runner is not None else None
+    lo, hi = self._row_range(batch, test)
+    batches = self._columns['batch']
+    repetitions = self._columns['repetition']
+    test_ids = self._columns['test']
+    runner_ids = self._columns['runner']
+    results = []
+    group = None
+    group_results = []
+    for row in range(lo, hi):
+      if runner_id is not None and runner_ids[row] != runner_id:
+        continue
+      if repetition is not None and repetitions[row] != repetition:
+        continue
+      if not combine_repetitions:
+        results.append(ExperimentResult(
+          batches[row], repetitions[row], self._tests[test_ids[row]], self._runners[runner_ids[row]],
+          self._result(row)
+        ))
+        continue
+      key = (batches[row], test_ids[row], runner_ids[row])
+      if key != group and group_results:
+        results.append(self._combined_result(group, group_results))
+        group_results = []
+      group = key
+      group_results.append(self._result(row))
+    if group_results:
+      results.append(self._combined_result(group, group_results))
+    return results
+
+  def _combined_result(self, key, results):
+    batch, test_id, runner_id = key
+    return ExperimentResult(batch, None, self._tests[test_id], self._runners[runner_id], Result.merge(results))
+
+
+def load_experiment_results(path):
+  # Reads experiment data written by dump_batched_experiment_data.py in either the pickled or the columnar format.
+  if is_columnar_file(path):
+    return ColumnarExperimentResults(path)
+  with open(path, 'rb') as f:
+    return pickle.load(f)
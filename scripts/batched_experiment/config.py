@@ -1,15 +1,61 @@
+import heapq
+import itertools
 import json
 import os
+import random
+import re
+import statistics
 
 
 from functools import total_ordering
 
 
+# Iteration counts used by JMH when -wi and -i are not given.
+JMH_DEFAULT_WARMUP_ITERATIONS = 5
+JMH_DEFAULT_MEASUREMENT_ITERATIONS = 5
+# Allowances (in seconds) for JVM startup and benchmark setup added on top of the measurement time in time budgets.
+JMH_STARTUP_ALLOWANCE = 30
+JMH_FORK_STARTUP_ALLOWANCE = 10
+DEFAULT_TIMEOUT_FACTOR = 3
+# JMH benchmark modes: throughput, average time, sample time and single shot time.
+JMH_BENCHMARK_MODES = ('thrpt', 'avgt', 'sample', 'ss')
+# Parameters of JMH runners that a matrix section of the configuration can vary, in the order they appear in names.
+MATRIX_AXES = ('java', 'jvm_args', 'forks', 'time', 'threads')
+
+
+def matrix_label(value):
+  # Labels become part of runner names, which are used as file names.
+  if isinstance(value, (list, tuple)):
+    value = ' '.join(str(v) for v in value)
+  return re.sub(r'[^A-Za-z0-9.+=-]+', '_', str(value)).strip('_')
+
+
+# Tests by class and method name, so that all results of a test refer to the same instance.
+_interned_tests = {}
+
+
 @total_ordering
 class Test:
-  def __init__(self, class_name, method_name):
-    self.class_name = class_name
-    self.method_name = method_name
+  __slots__ = ('class_name', 'method_name')
+
+  def __new__(cls, class_name=None, method_name=None):
+    if class_name is None and method_name is None:
+      # Unpickling a test pickled before tests were interned, its names are set by __setstate__.
+      return super().__new__(cls)
+    test = _interned_tests.get((class_name, method_name))
+    if test is None:
+      test = super().__new__(cls)
+      test.class_name = class_name
+      test.method_name = method_name
+      _interned_tests[(class_name, method_name)] = test
+    return test
+
+  def __reduce__(self):
+    return Test, (self.class_name, self.method_name)
+
+  def __setstate__(self, state):
+    self.class_name = state['class_name']
+    self.method_name = state['method_name']
 
   def __eq__(self, other):
     if isinstance(other, Test):
@@ -28,6 +74,22 @@ class RunnerConfiguration:
   def __init__(self, name, approach):
     self.name = name
     self.approach = approach
+    # Per-test parameter values taking precedence over the runner's own, e.g. {Test: {'time': 500}}.
+    self.overrides = {}
+
+  def parameter(self, test, name, default=None):
+    # Configurations pickled before overrides were supported lack the attribute.
+    overrides = getattr(self, 'overrides', {})
+    if test in overrides and name in overrides[test]:
+      return overrides[test][name]
+    return getattr(self, name, default)
+
+  def scheduled(self, test, repetition):
+    # Whether the runner runs the test in the given repetition; overrides may skip a test or repeat it less often.
+    if self.parameter(test, 'skip', False):
+      return False
+    repetitions = self.parameter(test, 'repetitions')
+    return repetitions is None or repetition < repetitions
 
   def __eq__(self, other):
     if isinstance(other, RunnerConfiguration):
@@ -42,38 +104,279 @@ class RunnerConfiguration:
 
 
 class GradleTestRunnerConfiguration(RunnerConfiguration):
-  def __init__(self, name, project_root, subproject_path, executions):
+  def __init__(self, name, project_root, subproject_path, executions, launcher='gradle', timeout=None):
     super().__init__(name, 'gradle-test')
+    if launcher not in ('gradle', 'direct'):
+      raise ValueError('Unrecognised launcher: {}'.format(launcher))
     self.project_root = os.path.abspath(project_root)
     self.subproject_path = subproject_path
     self.executions = executions
+    self.launcher = launcher
+    self.timeout = timeout
     self.output_file = '{}_output.json'.format(self.name)
+    self.log_file = '{}_stderr.log'.format(self.name)
+    self.telemetry_file = '{}_telemetry.json'.format(self.name)
 
 
 class JmhRunnerConfiguration(RunnerConfiguration):
-  def __init__(self, name, approach, jar, forks, time):
+  def __init__(
+    self, name, approach, jar, forks, time, slots=1, cores=None, nice=None, cgroup=None, single_jvm=False,
+    timeout_factor=DEFAULT_TIMEOUT_FACTOR, profilers=None, java='java', jvm_args=None, threads=None, matrix=None,
+    matrix_name=None, mode=None, time_unit=None
+  ):
     super().__init__(name, approach)
+    if mode is not None and mode not in JMH_BENCHMARK_MODES:
+      raise ValueError('Unrecognised benchmark mode: {}'.format(mode))
+    # JMH receives the arguments joined into a single -jvmArgsAppend value, which it splits on whitespace again.
+    for jvm_arg in jvm_args or []:
+      if re.search(r'\s', jvm_arg):
+        raise ValueError('JVM argument {!r} of {} contains whitespace, which JMH cannot pass on'.format(
+          jvm_arg, name
+        ))
     self.jar = os.path.abspath(jar)
+    # Benchmark mode (-bm) and time unit (-tu), e.g. 'sample' and 'us'; None leaves them to the benchmark annotations.
+    self.mode = mode
+    self.time_unit = time_unit
+    self.java = java
+    # Appended to the JVM options of every fork; arguments cannot contain whitespace.
+    self.jvm_args = jvm_args if jvm_args is not None else []
     self.forks = forks
     self.time = time
+    # Benchmark threads (-t); None leaves the choice to the benchmark annotations.
+    self.threads = threads
+    # Runners expanded from a matrix section keep the section name and the label of their value on every axis.
+    self.matrix_name = matrix_name
+    self.matrix = matrix if matrix is not None else {}
+    self.single_jvm = single_jvm
+    self.timeout_factor = timeout_factor
+    # JMH profilers, e.g. gc, stack, cl, comp or perfnorm, whose results are collected as secondary metrics.
+    self.profilers = profilers if profilers is not None else []
+    if cores is not None and len(cores) != slots:
+      raise ValueError('Runner {} has {:d} slots but {:d} core sets'.format(name, slots, len(cores)))
+    self.slots = slots
+    self.cores = cores
+    self.nice = nice
+    self.cgroup = cgroup
+
+  def axis_label(self, axis):
+    # Configurations pickled before matrix expansion was supported lack the attributes.
+    matrix = getattr(self, 'matrix', {})
+    if axis in matrix:
+      return matrix[axis]
+    default = {'java': 'java', 'jvm_args': [], 'threads': None}.get(axis)
+    value = getattr(self, axis, default)
+    return matrix_label(value) if value is not None else None
 
   def benchmark_output_file(self, test):
     return os.path.join(self.name, test.class_name, test.method_name, 'output.json')
 
+  def benchmark_execution_file(self, test):
+    return os.path.join(self.name, test.class_name, test.method_name, 'execution.json')
+
+  def benchmark_telemetry_file(self, test):
+    return os.path.join(self.name, test.class_name, test.method_name, 'telemetry.json')
+
+  def benchmark_log_file(self, test):
+    return os.path.join(self.name, test.class_name, test.method_name, 'stderr.log')
+
+  def group_output_file(self, group):
+    return os.path.join(self.name, 'group{:d}_output.json'.format(group))
+
+  def group_log_file(self, group):
+    return os.path.join(self.name, 'group{:d}_stderr.log'.format(group))
+
+  def benchmark_time_budget(self, benchmarks=1, forks=None, time=None):
+    if self.timeout_factor is None:
+      return None
+    forks = forks if forks is not None else self.forks
+    time = time if time is not None else self.time
+    iterations = JMH_DEFAULT_WARMUP_ITERATIONS + JMH_DEFAULT_MEASUREMENT_ITERATIONS
+    fork_time = iterations * time / 1000 + JMH_FORK_STARTUP_ALLOWANCE
+    return self.timeout_factor * benchmarks * forks * fork_time + JMH_STARTUP_ALLOWANCE
+
+
+class AdaptiveRepetitionConfiguration:
+  def __init__(self, min_repetitions, target_relative_ci_width=None, target_cv_est=None, confidence=0.95):
+    if target_relative_ci_width is None and target_cv_est is None:
+      raise ValueError('Adaptive repetitions require a target confidence interval width or cv_est')
+    self.min_repetitions = min_repetitions
+    self.target_relative_ci_width = target_relative_ci_width
+    self.target_cv_est = target_cv_est
+    self.confidence = confidence
+
+  def converged(self, statistics):
+    if statistics.mean is None:
+      # Results with errors will not improve by repeating them.
+      return True
+    if statistics.stderr is None:
+      # A single measurement says nothing about the precision yet.
+      return False
+    if (
+      self.target_relative_ci_width is not None
+      and statistics.relative_ci_width(self.confidence) > self.target_relative_ci_width
+    ):
+      return False
+    if self.target_cv_est is not None and statistics.cv_est > self.target_cv_est:
+      return False
+    return True
+
+
+class BatchPackingConfiguration:
+  def __init__(self, costs_file=None, pilot_data_file=None, seed=0):
+    self.costs_file = costs_file
+    self.pilot_data_file = pilot_data_file
+    self.seed = seed
+    # Expected wall time of each test, tests without an estimate are assumed to take the median time. Costs are only
+    # loaded once tests are packed, which is skipped when the batches of a started experiment are read back.
+    self.costs = None
+    self.default_cost = None
+
+  def cost(self, test):
+    if self.costs is None:
+      self.costs = BatchPackingConfiguration.load_costs(self.costs_file, self.pilot_data_file)
+      self.default_cost = statistics.median(self.costs.values()) if self.costs else 1.0
+    return self.costs[test] if test in self.costs else self.default_cost
+
+  @staticmethod
+  def load_costs(costs_file=None, pilot_data_file=None):
+    costs = {}
+    if pilot_data_file is not None:
+      # Imported here, as the experiment data module depends on this one.
+      from batched_experiment.columnar import load_experiment_results
+      costs.update(load_experiment_results(pilot_data_file).test_costs())
+    if costs_file is not None:
+      with open(costs_file, 'r') as f:
+        costs.update({Test(cd['class'], cd['test']): cd['cost'] for cd in json.load(f)})
+    return costs
+
+
+class SchedulingConfiguration:
+  orders = ('fixed', 'shuffle', 'interleave')
+
+  def __init__(self, order='fixed', seed=0):
+    if order not in SchedulingConfiguration.orders:
+      raise ValueError('Unrecognised scheduling order: {}'.format(order))
+    self.order = order
+    self.seed = seed
+
+  def repetition_seed(self, batch, repetition):
+    # Derived per repetition, so that an interrupted repetition is resumed in the same order.
+    return '{}-{:d}-{:d}'.format(self.seed, batch, repetition)
+
+  @staticmethod
+  def splittable(runner_config):
+    # JMH runs every benchmark in its own invocation unless single_jvm groups them; Gradle runs all tests at once.
+    return isinstance(runner_config, JmhRunnerConfiguration) and not runner_config.single_jvm
+
+  def units(self, runner_configs, schedule, batch, repetition):
+    # The (runner index, tests) pairs a repetition is run as, in order; schedule maps runner names to their tests.
+    if self.order == 'fixed':
+      return [(i, schedule[rc.name]) for i, rc in enumerate(runner_configs) if schedule[rc.name]]
+    rng = random.Random(self.repetition_seed(batch, repetition))
+    split_units = []
+    whole_units = []
+    for i, runner_config in enumerate(runner_configs):
+      tests = list(schedule[runner_config.name])
+      if not tests:
+        continue
+      rng.shuffle(tests)
+      if SchedulingConfiguration.splittable(runner_config):
+        split_units.extend((i, [test]) for test in tests)
+      else:
+        whole_units.append((i, tests))
+    if self.order == 'shuffle':
+      units = split_units + whole_units
+      rng.shuffle(units)
+      return units
+    # Randomized multiple interleaved trials: a block runs one test on every runner, in a random runner order, and
+    # the blocks are in random test order. Runners that run all their tests at once join a random block.
+    tests = sorted({tests[0] for _, tests in split_units})
+    rng.shuffle(tests)
+    blocks = {test: [] for test in tests}
+    for unit in split_units:
+      blocks[unit[1][0]].append(unit)
+    blocks = list(blocks.values()) or [[]]
+    for unit in whole_units:
+      blocks[rng.randrange(len(blocks))].append(unit)
+    units = []
+    for block in blocks:
+      rng.shuffle(block)
+      units.extend(block)
+    return units
+
 
 class BatchedExperimentConfiguration:
   @staticmethod
   def _split_into_batches(tests, batch_size):
     return [tests[i:i+batch_size] for i in range(0, len(tests), batch_size)]
 
-  def __init__(self, tests, runner_configs, batch_size, repetitions, output_dir):
-    self.test_batches = BatchedExperimentConfiguration._split_into_batches(tests, batch_size)
+  @staticmethod
+  def _pack_into_batches(tests, batch_size, packing):
+    # Greedy longest-first packing into as many batches as fixed-size splitting would create, the seed breaks ties.
+    batch_count = (len(tests) + batch_size - 1) // batch_size
+    order = list(tests)
+    random.Random(packing.seed).shuffle(order)
+    order.sort(key=packing.cost, reverse=True)
+    loads = [(0.0, batch) for batch in range(batch_count)]
+    batches = [[] for _ in range(batch_count)]
+    for test in order:
+      load, batch = heapq.heappop(loads)
+      batches[batch].append(test)
+      heapq.heappush(loads, (load + packing.cost(test), batch))
+    positions = {test: i for i, test in enumerate(tests)}
+    return [sorted(batch, key=positions.get) for batch in batches]
+
+  def __init__(
+    self, tests, runner_configs, batch_size, repetitions, output_dir, adaptive=None, packing=None, scheduling=None
+  ):
+    self.output_dir = os.path.abspath(output_dir)
+    self.test_batches_file = os.path.join(self.output_dir, 'batches.json')
+    self.packing = packing
+    if packing is None:
+      self.test_batches = BatchedExperimentConfiguration._split_into_batches(tests, batch_size)
+    elif os.path.exists(self.test_batches_file):
+      # The assignment of an experiment that has been started is kept, even if the cost estimates have changed.
+      self.test_batches = self.load_test_batches()
+      if sorted(test for batch in self.test_batches for test in batch) != sorted(tests):
+        raise ValueError('The tests in {} do not match the test list'.format(self.test_batches_file))
+    else:
+      self.test_batches = BatchedExperimentConfiguration._pack_into_batches(tests, batch_size, packing)
     self.batch_size = batch_size
+    # With adaptive repetitions, this is the maximum number of repetitions of each test.
     self.repetitions = repetitions
+    self.adaptive = adaptive
+    self.scheduling = scheduling if scheduling is not None else SchedulingConfiguration()
     self.runner_configs = runner_configs
-    self.output_dir = os.path.abspath(output_dir)
     self.progress_file = os.path.join(self.output_dir, 'progress.json')
     self.progress_backup_file = os.path.join(self.output_dir, 'progress.json.old')
+    self.queue_dir = os.path.join(self.output_dir, 'queue')
+
+  def load_test_batches(self):
+    with open(self.test_batches_file, 'r') as f:
+      batches = json.load(f)['batches']
+    return [[Test(td['class'], td['test']) for td in batch['tests']] for batch in batches]
+
+  def save_test_batches(self):
+    if self.packing is None or os.path.exists(self.test_batches_file):
+      return
+    os.makedirs(self.output_dir, exist_ok=True)
+    batches = {
+      'seed': self.packing.seed,
+      'batches': [
+        {
+          'expected_cost': sum(self.packing.cost(test) for test in batch),
+          'tests': [{'class': test.class_name, 'test': test.method_name} for test in batch]
+        }
+        for batch in self.test_batches
+      ]
+    }
+    # Several workers may save the same assignment concurrently.
+    temporary_file = '{}.{:d}'.format(self.test_batches_file, os.getpid())
+    with open(temporary_file, 'w') as f:
+      json.dump(batches, f, indent=4)
+      f.flush()
+      os.fsync(f.fileno())
+    os.replace(temporary_file, self.test_batches_file)
 
   def batch_dir(self, batch):
     return os.path.join(self.output_dir, 'b{:d}'.format(batch))
@@ -81,6 +384,54 @@ class BatchedExperimentConfiguration:
   def repetition_dir(self, batch, repetition):
     return os.path.join(self.batch_dir(batch), 'r{:d}'.format(repetition))
 
+  def repetition_schedule_file(self, batch, repetition):
+    return os.path.join(self.repetition_dir(batch, repetition), 'schedule.json')
+
+  def repetition_order_file(self, batch, repetition):
+    return os.path.join(self.repetition_dir(batch, repetition), 'order.json')
+
+  def runner_worker_file(self, batch, repetition, runner_config):
+    return os.path.join(self.repetition_dir(batch, repetition), '{}_worker.json'.format(runner_config.name))
+
+  def runner_outputs_file(self, batch, repetition, runner_config):
+    return os.path.join(self.repetition_dir(batch, repetition), '{}_outputs.json'.format(runner_config.name))
+
+  def repetition_counts_file(self, batch):
+    return os.path.join(self.batch_dir(batch), 'repetitions.json')
+
+  @staticmethod
+  def expand_matrix(matrix_dict):
+    # Expands {"name": ..., "approach": ..., "axes": {"forks": [1, 3], "jvm_args": {"g1": ["-XX:+UseG1GC"]}}, ...}
+    # into one JMH runner configuration per combination of axis values. An axis is either a list of values or a
+    # mapping from labels to values; names are built from the labels in a fixed axis order, so they do not depend on
+    # the order of the configuration file.
+    axes = matrix_dict['axes']
+    for axis in axes:
+      if axis not in MATRIX_AXES:
+        raise ValueError('Unrecognised matrix axis {} of {}'.format(axis, matrix_dict['name']))
+    labelled_axes = []
+    for axis in MATRIX_AXES:
+      if axis not in axes:
+        continue
+      values = axes[axis]
+      if isinstance(values, dict):
+        labelled_values = [(matrix_label(label), value) for label, value in values.items()]
+      else:
+        labelled_values = [(matrix_label(value), value) for value in values]
+      labelled_axes.append([(axis, label, value) for label, value in labelled_values])
+    runner_config_dicts = []
+    for combination in itertools.product(*labelled_axes):
+      runner_config_dict = {key: value for key, value in matrix_dict.items() if key != 'axes'}
+      runner_config_dict['name'] = '{}[{}]'.format(
+        matrix_dict['name'], ','.join('{}={}'.format(axis, label) for axis, label, _ in combination)
+      )
+      runner_config_dict['matrix_name'] = matrix_dict['name']
+      runner_config_dict['matrix'] = {axis: label for axis, label, _ in combination}
+      for axis, _, value in combination:
+        runner_config_dict[axis] = value
+      runner_config_dicts.append(runner_config_dict)
+    return runner_config_dicts
+
   @staticmethod
   def parse_from_file(config_file):
     with open(config_file, 'r') as f:
@@ -98,16 +449,97 @@ class BatchedExperimentConfiguration:
         project_root = runner_config['project_root']
         subproject_path = runner_config['subproject_path'] if 'subproject_path' in runner_config else []
         executions = runner_config['executions']
-        return GradleTestRunnerConfiguration(name, project_root, subproject_path, executions)
+        launcher = runner_config['launcher'] if 'launcher' in runner_config else 'gradle'
+        timeout = runner_config['timeout'] if 'timeout' in runner_config else None
+        return GradleTestRunnerConfiguration(name, project_root, subproject_path, executions, launcher, timeout)
       elif approach in ('jmh', 'ju2jmh', 'ju4runner'):
         jar = runner_config['jar']
         forks = runner_config['forks']
         time = runner_config['time']
-        return JmhRunnerConfiguration(name, approach, jar, forks, time)
+        slots = runner_config['slots'] if 'slots' in runner_config else 1
+        cores = runner_config['cores'] if 'cores' in runner_config else None
+        if cores is not None and 'slots' not in runner_config:
+          slots = len(cores)
+        nice = runner_config['nice'] if 'nice' in runner_config else None
+        cgroup = runner_config['cgroup'] if 'cgroup' in runner_config else None
+        single_jvm = runner_config['single_jvm'] if 'single_jvm' in runner_config else False
+        timeout_factor = (
+          runner_config['timeout_factor'] if 'timeout_factor' in runner_config else DEFAULT_TIMEOUT_FACTOR
+        )
+        profilers = runner_config['profilers'] if 'profilers' in runner_config else None
+        return JmhRunnerConfiguration(
+          name, approach, jar, forks, time, slots, cores, nice, cgroup, single_jvm, timeout_factor, profilers,
+          java=runner_config['java'] if 'java' in runner_config else 'java',
+          jvm_args=runner_config['jvm_args'] if 'jvm_args' in runner_config else None,
+          threads=runner_config['threads'] if 'threads' in runner_config else None,
+          matrix=runner_config['matrix'] if 'matrix' in runner_config else None,
+          matrix_name=runner_config['matrix_name'] if 'matrix_name' in runner_config else None,
+          mode=runner_config['mode'] if 'mode' in runner_config else None,
+          time_unit=runner_config['time_unit'] if 'time_unit' in runner_config else None
+        )
       raise ValueError('Unrecognised approach: {}'.format(approach))
 
-    runner_configs = [parse_runner_config(rcd) for rcd in config_dict['configs']]
+    runner_config_dicts = list(config_dict['configs']) if 'configs' in config_dict else []
+    for matrix_dict in config_dict['matrix'] if 'matrix' in config_dict else []:
+      runner_config_dicts.extend(BatchedExperimentConfiguration.expand_matrix(matrix_dict))
+    runner_configs = [parse_runner_config(rcd) for rcd in runner_config_dicts]
+    names = [runner_config.name for runner_config in runner_configs]
+    for name in names:
+      if names.count(name) > 1:
+        raise ValueError('Duplicate runner name: {}'.format(name))
+
+    runner_configs_by_name = {runner_config.name: runner_config for runner_config in runner_configs}
+    override_groups = {runner_config.approach for runner_config in runner_configs} | {
+      runner_config.matrix_name for runner_config in runner_configs if getattr(runner_config, 'matrix_name', None)
+    }
+    for test, test_dict in zip(tests, test_dicts):
+      # Optional per-test overrides, keyed by runner name, matrix name or approach:
+      # {"overrides": {"<runner>": {"time": 500}}}. Besides runner parameters such as forks, time, executions and
+      # timeout, "skip" excludes the test from a runner and "repetitions" runs it in fewer repetitions than the
+      # experiment.
+      overrides = test_dict['overrides'] if 'overrides' in test_dict else {}
+      for key in overrides:
+        if key not in runner_configs_by_name and key not in override_groups:
+          raise ValueError('Overrides of {}.{} refer to unknown runner {}'.format(
+            test.class_name, test.method_name, key
+          ))
+      for runner_config in runner_configs:
+        # Overrides of a runner take precedence over those of its matrix, which take precedence over its approach.
+        parameters = {}
+        for key in (runner_config.approach, getattr(runner_config, 'matrix_name', None), runner_config.name):
+          if key is not None and key in overrides:
+            parameters.update(overrides[key])
+        if parameters:
+          runner_config.overrides[test] = parameters
+
+    adaptive = None
+    if 'adaptive' in config_dict:
+      adaptive_dict = config_dict['adaptive']
+      adaptive = AdaptiveRepetitionConfiguration(
+        adaptive_dict['min_repetitions'] if 'min_repetitions' in adaptive_dict else 2,
+        adaptive_dict['target_relative_ci_width'] if 'target_relative_ci_width' in adaptive_dict else None,
+        adaptive_dict['target_cv_est'] if 'target_cv_est' in adaptive_dict else None,
+        adaptive_dict['confidence'] if 'confidence' in adaptive_dict else 0.95
+      )
+
+    packing = None
+    if 'packing' in config_dict:
+      packing_dict = config_dict['packing']
+      packing = BatchPackingConfiguration(
+        packing_dict['costs'] if 'costs' in packing_dict else None,
+        packing_dict['pilot_data'] if 'pilot_data' in packing_dict else None,
+        packing_dict['seed'] if 'seed' in packing_dict else 0
+      )
+
+    scheduling = None
+    if 'scheduling' in config_dict:
+      scheduling_dict = config_dict['scheduling']
+      scheduling = SchedulingConfiguration(
+        scheduling_dict['order'] if 'order' in scheduling_dict else 'fixed',
+        scheduling_dict['seed'] if 'seed' in scheduling_dict else 0
+      )
 
     return BatchedExperimentConfiguration(
-      tests, runner_configs, config_dict['batch_size'], config_dict['repetitions'], config_dict['output_dir']
+      tests, runner_configs, config_dict['batch_size'], config_dict['repetitions'], config_dict['output_dir'],
+      adaptive=adaptive, packing=packing, scheduling=scheduling
     )
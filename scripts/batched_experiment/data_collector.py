@@ -1,12 +1,19 @@
+import concurrent.futures
 import itertools
 import json
+import math
 import os
 
 
 from batched_experiment._util import clear_console_line
 from batched_experiment.config import Test
-from batched_experiment.error import BenchmarkExecutionFailedError
-from batched_experiment.experiment_data import ExperimentResult, ExperimentResults, Result
+from batched_experiment.error import BenchmarkExecutionFailedError, BenchmarkTimeoutError
+from batched_experiment.execution import STATUS_TIMEOUT
+from batched_experiment.jmh_output import read_benchmark_output
+from batched_experiment.experiment_data import (
+  ExperimentResult, ExperimentResults, LatencyHistogram, Result, Telemetry
+)
+from batched_experiment.work_queue import WorkQueue
 
 
 class RunnerDataCollector:
@@ -20,19 +27,53 @@ class GradleTestDataCollector(RunnerDataCollector):
     with open(repetition_output_file, 'r') as f:
       repetition_output = json.load(f)
     test_durations = {Test(t['class'], t['test']): t['test_durations'] for t in repetition_output}
+    test_durations_ns = {
+      Test(t['class'], t['test']): t['test_durations_ns'] for t in repetition_output if 'test_durations_ns' in t
+    }
+    # The Gradle or launcher processes run all tests of the batch, so their telemetry is shared by the tests.
+    telemetry = self.collect_telemetry(repetition_output_dir)
     results = {}
     for test in tests:
       try:
-        result = Result(throughput=self.durations_to_throughput(test_durations[test]))
+        throughput = self.durations_to_throughput(test_durations[test], test_durations_ns.get(test))
+        result = Result(throughput=throughput, fork_lengths=self.fork_lengths(len(throughput)))
+      except BenchmarkTimeoutError:
+        result = Result(errors=['TIMEOUT'])
       except BenchmarkExecutionFailedError:
         result = Result(errors=['FAILED'])
       except ZeroDivisionError:
         result = Result(errors=['ZERO_DURATION'])
+      result.telemetry = telemetry
       results[test] = result
     return results
 
-  def durations_to_throughput(self, durations):
+  def output_files(self, repetition_output_dir):
+    return [
+      os.path.join(repetition_output_dir, self.config.output_file),
+      os.path.join(repetition_output_dir, self.config.telemetry_file)
+    ]
+
+  def fork_lengths(self, executions):
+    # Every execution through Gradle runs in a fresh test JVM, while the direct launcher reuses one JVM.
+    if self.config.launcher == 'direct':
+      return [executions]
+    return [1] * executions
+
+  def collect_telemetry(self, repetition_output_dir):
+    telemetry_file = os.path.join(repetition_output_dir, self.config.telemetry_file)
+    if not os.path.exists(telemetry_file):
+      return None
+    with open(telemetry_file, 'r') as f:
+      return Telemetry.combine(Telemetry.from_dict(d) for d in json.load(f))
+
+  def durations_to_throughput(self, durations, durations_ns=None):
+    if durations_ns is not None:
+      # Prefer nanosecond timings, which runners only record when they were measured in the test JVM; the seconds in
+      # JUnit XML are often rounded to 0.
+      durations = [d if isinstance(d, str) else d / 1e9 for d in durations_ns]
     for duration in durations:
+      if duration == STATUS_TIMEOUT:
+        raise BenchmarkTimeoutError()
       if duration == 'FAILED':
         raise BenchmarkExecutionFailedError()
     return [1.0 / float(d) for d in durations]
@@ -42,21 +83,113 @@ class JmhBenchmarkDataCollector(RunnerDataCollector):
   def collect_repetition_data(self, tests, repetition_output_dir):
     results = {}
     for test in tests:
+      execution = self.collect_execution_data(test, repetition_output_dir)
+      telemetry = self.collect_telemetry(test, repetition_output_dir)
+      if execution is not None and execution.get('status') == STATUS_TIMEOUT:
+        results[test] = Result(errors=['TIMEOUT'], execution=execution, telemetry=telemetry)
+        continue
       try:
-        result = Result(throughput=self.collect_benchmark_data(test, repetition_output_dir))
+        benchmark_output = self.read_benchmark_output(test, repetition_output_dir)
+        metrics, metric_units = self.collect_secondary_metrics(benchmark_output)
+        throughput, fork_lengths, latency = self.collect_benchmark_data(benchmark_output)
+        result = Result(
+          throughput=throughput, execution=execution, telemetry=telemetry, metrics=metrics,
+          metric_units=metric_units, fork_lengths=fork_lengths, latency=latency
+        )
       except BenchmarkExecutionFailedError:
-        result = Result(errors=['FAILED'])
+        result = Result(errors=['FAILED'], execution=execution, telemetry=telemetry)
+      except ZeroDivisionError:
+        result = Result(errors=['ZERO_DURATION'], execution=execution, telemetry=telemetry)
       results[test] = result
     return results
 
-  def collect_benchmark_data(self, test, repetition_output_dir):
+  def output_files(self, repetition_output_dir):
+    files = []
+    for directory, _, file_names in os.walk(os.path.join(repetition_output_dir, self.config.name)):
+      files.extend(os.path.join(directory, file_name) for file_name in file_names)
+    return files
+
+  def collect_telemetry(self, test, repetition_output_dir):
+    telemetry_file = os.path.join(repetition_output_dir, self.config.benchmark_telemetry_file(test))
+    if not os.path.exists(telemetry_file):
+      return None
+    with open(telemetry_file, 'r') as f:
+      return Telemetry.from_dict(json.load(f))
+
+  def collect_execution_data(self, test, repetition_output_dir):
+    execution_file = os.path.join(repetition_output_dir, self.config.benchmark_execution_file(test))
+    if not os.path.exists(execution_file):
+      return None
+    with open(execution_file, 'r') as f:
+      return json.load(f)
+
+  def read_benchmark_output(self, test, repetition_output_dir):
     benchmark_output_file = os.path.join(repetition_output_dir, self.config.benchmark_output_file(test))
     if os.path.getsize(benchmark_output_file) == 0:
       # An empty results file means that the benchmark execution failed.
       raise BenchmarkExecutionFailedError()
-    with open(benchmark_output_file, 'r') as f:
-      raw_throughput = json.load(f)[0]['primaryMetric']['rawData']
-    return list(itertools.chain.from_iterable(raw_throughput))
+    # Secondary metrics are only decoded if profilers were configured to report them; configurations pickled before
+    # profilers were supported lack the attribute.
+    return read_benchmark_output(benchmark_output_file, secondary_metrics=bool(getattr(self.config, 'profilers', [])))
+
+  def collect_benchmark_data(self, benchmark_output):
+    primary_metric = benchmark_output['primaryMetric']
+    mode = benchmark_output['mode'] if 'mode' in benchmark_output else 'thrpt'
+    unit = primary_metric['scoreUnit'].split('/')[0] if 'scoreUnit' in primary_metric else None
+    if 'rawDataHistogram' in primary_metric:
+      # Sample time mode reports each iteration as [time, count] pairs. They are binned as they are read, and the
+      # iterations are reduced to their throughput so that they can be analysed like those of other modes.
+      raw_histogram = primary_metric['rawDataHistogram']
+      latency = LatencyHistogram(unit)
+      throughput = []
+      for fork in raw_histogram:
+        for iteration in fork:
+          operations = 0
+          total_time = 0.0
+          for value, count in iteration:
+            latency.add(value, count)
+            operations += count
+            total_time += value * count
+          throughput.append(operations / total_time)
+      return throughput, [len(fork) for fork in raw_histogram], latency
+    # rawData holds the measurement iterations of every fork.
+    raw_data = primary_metric['rawData']
+    values = list(itertools.chain.from_iterable(raw_data))
+    if mode in ('avgt', 'ss'):
+      # Times per operation are turned into operations per time unit.
+      values = [1.0 / value for value in values]
+    return values, [len(fork) for fork in raw_data], None
+
+  def collect_secondary_metrics(self, benchmark_output):
+    metrics = {}
+    metric_units = {}
+    secondary_metrics = benchmark_output['secondaryMetrics'] if 'secondaryMetrics' in benchmark_output else {}
+    for name, metric in secondary_metrics.items():
+      if 'rawData' not in metric:
+        continue
+      values = [value for value in itertools.chain.from_iterable(metric['rawData']) if not math.isnan(value)]
+      if not values:
+        # Profilers such as stack report their results in textual form only.
+        continue
+      # Older JMH versions prefix secondary metric names with a middle dot.
+      name = name.lstrip('\u00b7')
+      metrics[name] = values
+      metric_units[name] = metric['scoreUnit'] if 'scoreUnit' in metric else None
+    return metrics, metric_units
+
+
+# Collector of each process of a parallel collection, created once per process rather than sent with every unit.
+_process_collector = None
+
+
+def _initialize_process_collector(config):
+  global _process_collector
+  _process_collector = ExperimentDataCollector(config)
+
+
+def _collect_unit(unit):
+  batch, repetition, runner_tests = unit
+  return _process_collector._collect_repetition_data(batch, repetition, runner_tests)
 
 
 class ExperimentDataCollector:
@@ -81,40 +214,256 @@ class ExperimentDataCollector:
     else:
       progress_file = self.config.progress_file
     with open(progress_file, 'r') as f:
-      progress = json.load(f)
-    self._progress = progress['batch']
+      self._progress = json.load(f)
 
   @property
   def finished_batches(self):
     if self._progress is None:
       self._load_progress()
-    return self._progress
+    return self._progress['batch']
 
   @property
   def repetitions(self):
     return self.config.repetitions
 
-  def _collect_repetition_data(self, batch, repetition):
-    tests = self.config.test_batches[batch]
-    repetition_dir = self.config.repetition_dir(batch, repetition)
-    collector_results = {
-      collector.config: collector.collect_repetition_data(tests, repetition_dir)
+  def _partial_repetition_tests(self):
+    # Tests of the current repetition of the unfinished batch, per runner, that have been checkpointed as finished.
+    tests = self.config.test_batches[self.finished_batches]
+    completed_runners = self._progress['completed_runners'] if 'completed_runners' in self._progress else []
+    completed_benchmarks = (
+      self._progress['completed_benchmarks'] if 'completed_benchmarks' in self._progress else {}
+    )
+    runner_tests = {}
+    for collector in self.runner_data_collectors:
+      name = collector.config.name
+      if name in completed_runners:
+        runner_tests[collector.config] = tests
+      elif name in completed_benchmarks:
+        completed = {Test(class_name, method_name) for class_name, method_name in completed_benchmarks[name]}
+        runner_tests[collector.config] = [test for test in tests if test in completed]
+    return runner_tests
+
+  def _repetition_schedule(self, batch, repetition):
+    # Only written for adaptive experiments, where later repetitions run a subset of the tests.
+    schedule_file = self.config.repetition_schedule_file(batch, repetition)
+    if not os.path.exists(schedule_file):
+      return None
+    with open(schedule_file, 'r') as f:
+      schedule = json.load(f)
+    return {
+      collector.config: [Test(class_name, method_name) for class_name, method_name in schedule[collector.config.name]]
       for collector in self.runner_data_collectors
     }
+
+  def _repetition_order(self, batch, repetition):
+    # Position of each (runner name, test) in the order of the repetition, and the times its unit was run.
+    order_file = self.config.repetition_order_file(batch, repetition)
+    if not os.path.exists(order_file):
+      return {}
+    with open(order_file, 'r') as f:
+      order = json.load(f)
+    positions = {}
+    for position, unit in enumerate(order['units']):
+      execution = {'order': position}
+      for key in ('started', 'finished'):
+        if key in unit:
+          execution[key] = unit[key]
+      for class_name, method_name in unit['tests']:
+        positions[unit['runner'], Test(class_name, method_name)] = execution
+    return positions
+
+  def _repetition_runner_tests(self, batch, repetition, runner_tests=None):
+    # The tests each runner has output for in a repetition, as (collector, tests) pairs.
+    if not os.path.exists(self.config.repetition_dir(batch, repetition)):
+      # Adaptive experiments may stop repeating a batch before the maximum number of repetitions.
+      return []
+    if runner_tests is None:
+      runner_tests = self._repetition_schedule(batch, repetition)
+    collector_tests = []
+    for collector in self.runner_data_collectors:
+      if runner_tests is None:
+        tests = self.config.test_batches[batch]
+      elif collector.config in runner_tests:
+        tests = runner_tests[collector.config]
+      else:
+        continue
+      # Tests skipped by their overrides have no output.
+      tests = [test for test in tests if collector.config.scheduled(test, repetition)]
+      if tests:
+        collector_tests.append((collector, tests))
+    return collector_tests
+
+  def _collect_repetition_data(self, batch, repetition, runner_tests=None):
+    repetition_dir = self.config.repetition_dir(batch, repetition)
+    collector_results = {}
+    order = self._repetition_order(batch, repetition)
+    for collector, tests in self._repetition_runner_tests(batch, repetition, runner_tests):
+      collector_results[collector.config] = collector.collect_repetition_data(tests, repetition_dir)
+      for test, result in collector_results[collector.config].items():
+        if (collector.config.name, test) in order:
+          execution = dict(result.execution) if result.execution is not None else {}
+          # Times recorded by the runner for the test itself take precedence over those of its unit.
+          for key, value in order[collector.config.name, test].items():
+            if execution.get(key) is None:
+              execution[key] = value
+          result.execution = execution
+      worker_file = self.config.runner_worker_file(batch, repetition, collector.config)
+      if os.path.exists(worker_file):
+        with open(worker_file, 'r') as f:
+          worker = json.load(f)
+        for result in collector_results[collector.config].values():
+          execution = dict(result.execution) if result.execution is not None else {}
+          execution['worker'] = worker
+          result.execution = execution
     results = []
     for config in collector_results:
       for test in collector_results[config]:
         results.append(ExperimentResult(batch, repetition, test, config, collector_results[config][test]))
     return results
 
-  def collect_experiment_data(self, progress_callback=None):
+  def _queue_units(self, include_partial):
+    # Work items completed by distributed workers, grouped by repetition.
+    completed = {}
+    for item in WorkQueue(self.config.queue_dir).done_items():
+      completed.setdefault((item.batch, item.repetition), set()).add(item.runner_index)
+    complete_batches = {
+      batch for batch in range(len(self.config.test_batches))
+      if all(
+        len(completed.get((batch, repetition), ())) == len(self.runner_data_collectors)
+        for repetition in range(self.repetitions)
+      )
+    }
+    units = []
+    for (batch, repetition), runner_indices in sorted(completed.items()):
+      if batch in complete_batches:
+        units.append((batch, repetition, None))
+      elif include_partial:
+        tests = self.config.test_batches[batch]
+        units.append((batch, repetition, {self.config.runner_configs[i]: tests for i in sorted(runner_indices)}))
+    return units
+
+  def collect_experiment_data(self, progress_callback=None, include_partial=False, workers=1):
+    # With more than one worker, repetitions are read in a process pool; None uses a process per core.
+    if os.path.exists(self.config.queue_dir):
+      units = self._queue_units(include_partial)
+      total_batches = len({batch for batch, _, _ in units})
+    else:
+      units, total_batches = self._progress_units(include_partial)
+
+    def report_progress(batch, repetition):
+      if progress_callback:
+        progress_callback(
+          current_batch=batch, current_repetition=repetition, total_batches=total_batches,
+          total_repetitions=self.repetitions
+        )
+
+    return ExperimentResults.from_results(self.config, self._collect_units(units, report_progress, workers))
+
+  def _collect_units(self, units, report_progress, workers):
+    results = []
+    if workers == 1 or len(units) <= 1:
+      for batch, repetition, runner_tests in units:
+        report_progress(batch, repetition)
+        results.extend(self._collect_repetition_data(batch, repetition, runner_tests))
+      return results
+    workers = workers if workers is not None else os.cpu_count()
+    with concurrent.futures.ProcessPoolExecutor(
+      max_workers=workers, initializer=_initialize_process_collector, initargs=(self.config,)
+    ) as executor:
+      # map returns the results in the order of the units, so the merged results do not depend on scheduling.
+      chunksize = max(1, len(units) // (workers * 16))
+      for (batch, repetition, _), unit_results in zip(units, executor.map(_collect_unit, units, chunksize=chunksize)):
+        report_progress(batch, repetition)
+        results.extend(unit_results)
+    return results
+
+  def _output_fingerprint(self, batch, repetition, collector):
+    # Sizes and modification times of the files a (batch, repetition, runner) unit is read from.
+    repetition_dir = self.config.repetition_dir(batch, repetition)
+    files = collector.output_files(repetition_dir) + [
+      self.config.repetition_schedule_file(batch, repetition),
+      self.config.repetition_order_file(batch, repetition),
+      self.config.runner_worker_file(batch, repetition, collector.config)
+    ]
+    fingerprint = {}
+    for path in files:
+      try:
+        stat = os.stat(path)
+      except FileNotFoundError:
+        continue
+      fingerprint[os.path.relpath(path, self.config.output_dir)] = [stat.st_size, stat.st_mtime_ns]
+    return fingerprint
+
+  def collect_experiment_data_incrementally(
+    self, previous_results, manifest, progress_callback=None, include_partial=False, workers=1
+  ):
+    # Only (batch, repetition, runner) units whose output is new or changed since the manifest was written are read;
+    # the results of the others are taken from previous_results. Units that are no longer part of the experiment,
+    # e.g. because finished_batches went backwards after a reset, are dropped. Returns the results and the new
+    # manifest.
+    if os.path.exists(self.config.queue_dir):
+      units = self._queue_units(include_partial)
+      total_batches = len({batch for batch, _, _ in units})
+    else:
+      units, total_batches = self._progress_units(include_partial)
+    previous_entries = {
+      (entry['batch'], entry['repetition'], entry['runner']): entry for entry in manifest['units']
+    } if manifest is not None else {}
+    previous_unit_results = {}
+    if previous_results is not None:
+      for result in previous_results.get_results():
+        previous_unit_results.setdefault((result.batch, result.repetition, result.runner.name), []).append(result)
+
     results = []
-    for batch in range(self.finished_batches):
-      for repetition in range(self.repetitions):
-        if progress_callback:
-          progress_callback(
-            current_batch=batch, current_repetition=repetition, total_batches=self.finished_batches,
-            total_repetitions=self.repetitions
+    entries = []
+    changed_units = []
+    for batch, repetition, runner_tests in units:
+      changed_runner_tests = {}
+      for collector, tests in self._repetition_runner_tests(batch, repetition, runner_tests):
+        key = (batch, repetition, collector.config.name)
+        entry = {
+          'batch': batch,
+          'repetition': repetition,
+          'runner': collector.config.name,
+          'tests': [[test.class_name, test.method_name] for test in tests],
+          'files': self._output_fingerprint(batch, repetition, collector)
+        }
+        entries.append(entry)
+        previous_entry = previous_entries.get(key)
+        if previous_entry is not None and previous_entry['tests'] == entry['tests'] and (
+          previous_entry['files'] == entry['files'] and key in previous_unit_results
+        ):
+          # Results pickled with an older configuration are attached to the current runner configuration.
+          results.extend(
+            ExperimentResult(result.batch, result.repetition, result.test, collector.config, result.result)
+            for result in previous_unit_results[key]
           )
-        results.extend(self._collect_repetition_data(batch, repetition))
-    return ExperimentResults.from_results(self.config, results)
+        else:
+          changed_runner_tests[collector.config] = tests
+      if changed_runner_tests:
+        changed_units.append((batch, repetition, changed_runner_tests))
+
+    def report_progress(batch, repetition):
+      if progress_callback:
+        progress_callback(
+          current_batch=batch, current_repetition=repetition, total_batches=total_batches,
+          total_repetitions=self.repetitions
+        )
+
+    results.extend(self._collect_units(changed_units, report_progress, workers))
+    return ExperimentResults.from_results(self.config, results), {'units': entries}
+
+  def _progress_units(self, include_partial):
+    units = [
+      (batch, repetition, None) for batch in range(self.finished_batches) for repetition in range(self.repetitions)
+    ]
+    total_batches = self.finished_batches
+    if include_partial and self.finished_batches < len(self.config.test_batches):
+      batch = self.finished_batches
+      units.extend((batch, repetition, None) for repetition in range(self._progress['repetition']))
+      runner_tests = self._partial_repetition_tests()
+      if runner_tests:
+        units.append((batch, self._progress['repetition'], runner_tests))
+      if len(units) > total_batches * self.repetitions:
+        total_batches += 1
+    return units, total_batches
@@ -1,2 +1,6 @@
 class BenchmarkExecutionFailedError(Exception):
   pass
+
+
+class BenchmarkTimeoutError(BenchmarkExecutionFailedError):
+  pass
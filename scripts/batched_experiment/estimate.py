@@ -0,0 +1,158 @@
+import datetime
+import os
+import subprocess
+import time
+
+
+from batched_experiment.config import (
+  JMH_DEFAULT_MEASUREMENT_ITERATIONS, JMH_DEFAULT_WARMUP_ITERATIONS, JmhRunnerConfiguration
+)
+
+
+# Overheads (in seconds) assumed when they have not been measured.
+DEFAULT_JVM_STARTUP = 1.0
+DEFAULT_GRADLE_STARTUP = 10.0
+# Assumed duration (in seconds) of a single unit test execution, corrected by the timing history of a run.
+DEFAULT_TEST_DURATION = 0.1
+# Number of most recent runner executions used to calibrate the estimates of a runner.
+TIMING_HISTORY_WINDOW = 20
+
+
+def format_duration(seconds):
+  return str(datetime.timedelta(seconds=round(seconds)))
+
+
+def measure_command_time(command, cwd=None):
+  start = time.monotonic()
+  try:
+    subprocess.run(command, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+  except (OSError, subprocess.CalledProcessError):
+    return None
+  return time.monotonic() - start
+
+
+class ExperimentCostEstimator:
+  def __init__(
+    self, config, jvm_startup=DEFAULT_JVM_STARTUP, gradle_startup=DEFAULT_GRADLE_STARTUP, timing_history=None
+  ):
+    self.config = config
+    self.jvm_startup = jvm_startup
+    self.gradle_startup = gradle_startup
+    self.timing_history = timing_history if timing_history is not None else []
+    # Configuration-derived estimates by (batch, repetition, runner name), which only depend on the configuration.
+    self._configuration_estimates = {}
+
+  @property
+  def timing_history(self):
+    return self._timing_history
+
+  @timing_history.setter
+  def timing_history(self, timing_history):
+    # Only the most recent executions of each runner are used, so older ones are not kept.
+    runner_entries = {}
+    recent = []
+    for entry in reversed(timing_history):
+      runner_entries[entry['runner']] = runner_entries.get(entry['runner'], 0) + 1
+      if runner_entries[entry['runner']] <= TIMING_HISTORY_WINDOW:
+        recent.append(entry)
+    recent.reverse()
+    self._timing_history = recent
+    # Calibrations by runner name, which only change when the history does.
+    self._calibrations = {}
+
+  @staticmethod
+  def measure_overheads(config):
+    jvm_startup = measure_command_time(['java', '-version'])
+    gradle_startup = None
+    for runner_config in config.runner_configs:
+      if runner_config.approach == 'gradle-test':
+        gradlew = os.path.join(runner_config.project_root, 'gradlew.bat' if os.name == 'nt' else 'gradlew')
+        # The runner starts a fresh build for every execution of the tests.
+        gradle_startup = measure_command_time([gradlew, '-q', '--no-daemon', 'help'], cwd=runner_config.project_root)
+        break
+    return (
+      jvm_startup if jvm_startup is not None else DEFAULT_JVM_STARTUP,
+      gradle_startup if gradle_startup is not None else DEFAULT_GRADLE_STARTUP
+    )
+
+  def configuration_estimate(self, runner_config, tests):
+    # Wall time of running the given tests in one repetition, derived from the configuration and its per-test
+    # overrides alone.
+    if not tests:
+      return 0.0
+    if isinstance(runner_config, JmhRunnerConfiguration):
+      iterations = JMH_DEFAULT_WARMUP_ITERATIONS + JMH_DEFAULT_MEASUREMENT_ITERATIONS
+      def fork_time(time):
+        return iterations * time / 1000 + self.jvm_startup
+      # Tests without overrides, usually all of them, take the runner's own time.
+      overrides = getattr(runner_config, 'overrides', {})
+      default_time = runner_config.forks * fork_time(runner_config.time)
+      benchmark_time = sum(
+        runner_config.parameter(test, 'forks') * fork_time(runner_config.parameter(test, 'time'))
+        if test in overrides else default_time
+        for test in tests
+      )
+      parallelism = min(runner_config.slots, len(tests))
+      processes = parallelism if runner_config.single_jvm else len(tests)
+      return (benchmark_time + processes * self.jvm_startup) / parallelism
+    test_executions = [runner_config.parameter(test, 'executions') for test in tests]
+    execution_time = sum(test_executions) * DEFAULT_TEST_DURATION
+    if runner_config.launcher == 'direct':
+      return self.jvm_startup + execution_time
+    return max(test_executions) * self.gradle_startup + execution_time
+
+  def calibration(self, runner_config):
+    # Ratio between the measured and the configuration-derived time of the most recent executions of the runner.
+    # Entries recorded before the configuration-derived time was stored with them are left out.
+    if runner_config.name not in self._calibrations:
+      entries = [
+        entry for entry in self.timing_history if entry['runner'] == runner_config.name and 'estimated' in entry
+      ]
+      estimated = sum(entry['estimated'] for entry in entries)
+      calibration = sum(entry['elapsed'] for entry in entries) / estimated if estimated > 0 else 1.0
+      self._calibrations[runner_config.name] = calibration
+    return self._calibrations[runner_config.name]
+
+  def runner_estimate(self, runner_config, tests):
+    return self.configuration_estimate(runner_config, tests) * self.calibration(runner_config)
+
+  def scheduled_configuration_estimate(self, batch, repetition, runner_config):
+    key = (batch, repetition, runner_config.name)
+    if key not in self._configuration_estimates:
+      tests = self.config.test_batches[batch]
+      # Only tests with overrides can be left out of a repetition.
+      if getattr(runner_config, 'overrides', {}):
+        tests = [test for test in tests if runner_config.scheduled(test, repetition)]
+      self._configuration_estimates[key] = self.configuration_estimate(runner_config, tests)
+    return self._configuration_estimates[key]
+
+  def repetition_estimate(self, batch, repetition, completed_runners=()):
+    return sum(
+      self.scheduled_configuration_estimate(batch, repetition, runner_config) * self.calibration(runner_config)
+      for runner_config in self.config.runner_configs if runner_config.name not in completed_runners
+    )
+
+  def batch_estimate(self, batch, repetition=0, completed_runners=()):
+    # With adaptive repetitions, this is an upper bound.
+    if repetition >= self.config.repetitions:
+      return 0.0
+    return self.repetition_estimate(batch, repetition, completed_runners) + sum(
+      self.repetition_estimate(batch, r) for r in range(repetition + 1, self.config.repetitions)
+    )
+
+  def experiment_estimate(self, batch=0, repetition=0, completed_runners=()):
+    if batch >= len(self.config.test_batches):
+      return 0.0
+    return self.batch_estimate(batch, repetition, completed_runners) + sum(
+      self.batch_estimate(b) for b in range(batch + 1, len(self.config.test_batches))
+    )
+
+  def record(self, batch, repetition, runner_config, tests, elapsed):
+    self.timing_history = self.timing_history + [{
+      'batch': batch,
+      'repetition': repetition,
+      'runner': runner_config.name,
+      'tests': len(tests),
+      'estimated': self.configuration_estimate(runner_config, tests),
+      'elapsed': elapsed
+    }]
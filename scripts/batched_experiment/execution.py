@@ -0,0 +1,152 @@
+import asyncio
+import os
+import signal
+import subprocess
+import threading
+import time
+
+
+from batched_experiment.experiment_data import Telemetry
+
+
+STATUS_COMPLETED = 'COMPLETED'
+STATUS_TIMEOUT = 'TIMEOUT'
+
+
+def available_cores():
+  if hasattr(os, 'sched_getaffinity'):
+    return sorted(os.sched_getaffinity(0))
+  return list(range(os.cpu_count()))
+
+
+def split_cores(cores, slots):
+  if slots > len(cores):
+    raise ValueError('Cannot split {:d} cores into {:d} slots'.format(len(cores), slots))
+  cores_per_slot = len(cores) // slots
+  return [cores[i * cores_per_slot:(i + 1) * cores_per_slot] for i in range(slots)]
+
+
+class ExecutionSlot:
+  def __init__(self, index, cores=None, nice=None, cgroup=None):
+    self.index = index
+    self.cores = cores
+    self.nice = nice
+    self.cgroup = cgroup
+
+  def wrap_command(self, command):
+    prefix = []
+    if self.cgroup is not None:
+      # Move the shell into the cgroup before exec'ing the command so that every thread it starts is limited.
+      cgroup_procs = os.path.join(self.cgroup, 'cgroup.procs')
+      prefix.extend(['sh', '-c', 'echo $$ > "$0" && exec "$@"', cgroup_procs])
+    if self.cores is not None:
+      prefix.extend(['taskset', '-c', ','.join(str(core) for core in self.cores)])
+    if self.nice is not None:
+      prefix.extend(['nice', '-n', str(self.nice)])
+    return prefix + list(command)
+
+  def to_dict(self):
+    return {'slot': self.index, 'cores': self.cores, 'nice': self.nice, 'cgroup': self.cgroup}
+
+
+def create_slots(config):
+  if config.cores is not None:
+    core_map = config.cores
+  elif config.slots > 1:
+    core_map = split_cores(available_cores(), config.slots)
+  else:
+    core_map = [None]
+  return [ExecutionSlot(i, core_map[i], config.nice, config.cgroup) for i in range(len(core_map))]
+
+
+class ProcessResult:
+  def __init__(self, status, returncode, telemetry=None):
+    self.status = status
+    self.returncode = returncode
+    self.telemetry = telemetry
+
+  def to_dict(self):
+    return {'status': self.status, 'returncode': self.returncode}
+
+
+def kill_process_tree(process):
+  if not hasattr(os, 'killpg'):
+    # Without process groups, e.g. on Windows, only the process itself is killed.
+    process.kill()
+    return
+  # Processes are started in their own session, so the process group also contains e.g. forked JMH JVMs.
+  try:
+    os.killpg(process.pid, signal.SIGKILL)
+  except ProcessLookupError:
+    pass
+
+
+def wait_for_process(process, start_time):
+  if not hasattr(os, 'wait4'):
+    # Resource usage is not available, e.g. on Windows, so only the wall time is measured.
+    process.wait()
+    return Telemetry(time.monotonic() - start_time)
+  # Reaps the process with wait4 instead of waitpid to obtain the resource usage of the process and its descendants.
+  _, wait_status, rusage = os.wait4(process.pid, 0)
+  wall_time = time.monotonic() - start_time
+  process.returncode = os.waitstatus_to_exitcode(wait_status)
+  return Telemetry.from_rusage(rusage, wall_time)
+
+
+def _wait_in_thread(process, start_time):
+  # A dedicated thread per process, so that the waits of all slots can block concurrently.
+  loop = asyncio.get_running_loop()
+  future = loop.create_future()
+
+  def wait():
+    try:
+      result = wait_for_process(process, start_time)
+    except BaseException as e:
+      loop.call_soon_threadsafe(future.set_exception, e)
+    else:
+      loop.call_soon_threadsafe(future.set_result, result)
+
+  threading.Thread(target=wait, daemon=True).start()
+  return future
+
+
+async def run_process(command, timeout=None, log_file=None, cwd=None):
+  stderr = open(log_file, 'a') if log_file is not None else subprocess.DEVNULL
+  try:
+    start_time = time.monotonic()
+    process = subprocess.Popen(
+      command, cwd=cwd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=stderr, start_new_session=True
+    )
+  finally:
+    if log_file is not None:
+      stderr.close()
+  wait = _wait_in_thread(process, start_time)
+  try:
+    telemetry = await asyncio.wait_for(asyncio.shield(wait), timeout)
+    status = STATUS_COMPLETED
+  except asyncio.TimeoutError:
+    kill_process_tree(process)
+    telemetry = await wait
+    status = STATUS_TIMEOUT
+  return ProcessResult(status, process.returncode, telemetry)
+
+
+def run_in_slots(jobs, slots, job_finished_callback=None):
+  async def run_jobs():
+    free_slots = asyncio.Queue()
+    for slot in slots:
+      free_slots.put_nowait(slot)
+
+    async def run_job(job):
+      slot = await free_slots.get()
+      try:
+        result = await job(slot)
+      finally:
+        free_slots.put_nowait(slot)
+      if job_finished_callback:
+        job_finished_callback(result)
+      return result
+
+    return await asyncio.gather(*(run_job(job) for job in jobs))
+
+  return asyncio.run(run_jobs())
@@ -1,21 +1,215 @@
+import array
 import itertools
+import math
+
+
+from batched_experiment.config import JMH_DEFAULT_MEASUREMENT_ITERATIONS, JMH_DEFAULT_WARMUP_ITERATIONS
+
+
+# Relative width of the bins of latency histograms, which bounds the relative error of percentiles.
+LATENCY_HISTOGRAM_PRECISION = 0.01
+
+
+class LatencyHistogram:
+  def __init__(self, unit=None, precision=LATENCY_HISTOGRAM_PRECISION):
+    # Samples are counted in logarithmic bins, {index: count}, where bin i covers [base^i, base^(i + 1)).
+    self.unit = unit
+    self.precision = precision
+    self.counts = {}
+    self.zero_count = 0
+    self.total = 0
+
+  def _base(self):
+    return 1 + self.precision
+
+  def add(self, value, count=1):
+    if value <= 0:
+      self.zero_count += count
+    else:
+      index = math.floor(math.log(value, self._base()))
+      self.counts[index] = self.counts.get(index, 0) + count
+    self.total += count
+
+  @staticmethod
+  def from_samples(samples, unit=None):
+    # samples are [value, count] pairs as in the iterations of JMH's rawDataHistogram.
+    histogram = LatencyHistogram(unit)
+    for value, count in samples:
+      histogram.add(value, count)
+    return histogram
+
+  @staticmethod
+  def merge(histograms):
+    histograms = [histogram for histogram in histograms if histogram is not None]
+    if not histograms:
+      return None
+    merged = LatencyHistogram(histograms[0].unit, histograms[0].precision)
+    for histogram in histograms:
+      if histogram.unit != merged.unit or histogram.precision != merged.precision:
+        raise ValueError('Cannot merge latency histograms of different units or precisions')
+      for index, count in histogram.counts.items():
+        merged.counts[index] = merged.counts.get(index, 0) + count
+      merged.zero_count += histogram.zero_count
+      merged.total += histogram.total
+    return merged
+
+  def percentile(self, fraction):
+    # Nearest-rank percentile, represented by the geometric centre of its bin.
+    if self.total == 0:
+      return None
+    rank = max(1, math.ceil(fraction * self.total))
+    cumulative = self.zero_count
+    if cumulative >= rank:
+      return 0.0
+    for index in sorted(self.counts):
+      cumulative += self.counts[index]
+      if cumulative >= rank:
+        return self._base() ** (index + 0.5)
+    return self._base() ** (max(self.counts) + 0.5)
+
+
+class Telemetry:
+  fields = (
+    'wall_time', 'user_time', 'system_time', 'max_rss', 'voluntary_context_switches', 'involuntary_context_switches',
+    'processes'
+  )
+
+  def __init__(
+    self, wall_time, user_time=None, system_time=None, max_rss=None, voluntary_context_switches=None,
+    involuntary_context_switches=None, processes=1
+  ):
+    # Times are in seconds, max_rss is in kilobytes and covers the process and the descendants it waited for.
+    # Only the wall time is measured on platforms without wait4, e.g. Windows.
+    self.wall_time = wall_time
+    self.user_time = user_time
+    self.system_time = system_time
+    self.max_rss = max_rss
+    self.voluntary_context_switches = voluntary_context_switches
+    self.involuntary_context_switches = involuntary_context_switches
+    self.processes = processes
+
+  @staticmethod
+  def from_rusage(rusage, wall_time):
+    return Telemetry(
+      wall_time, rusage.ru_utime, rusage.ru_stime, rusage.ru_maxrss, rusage.ru_nvcsw, rusage.ru_nivcsw
+    )
+
+  @staticmethod
+  def combine(telemetries):
+    telemetries = [telemetry for telemetry in telemetries if telemetry is not None]
+    if not telemetries:
+      return None
+    def combined(field, aggregate):
+      values = [getattr(telemetry, field) for telemetry in telemetries if getattr(telemetry, field) is not None]
+      return aggregate(values) if values else None
+    return Telemetry(
+      combined('wall_time', sum),
+      combined('user_time', sum),
+      combined('system_time', sum),
+      combined('max_rss', max),
+      combined('voluntary_context_switches', sum),
+      combined('involuntary_context_switches', sum),
+      combined('processes', sum)
+    )
+
+  def to_dict(self):
+    return {field: getattr(self, field) for field in Telemetry.fields}
+
+  @staticmethod
+  def from_dict(d):
+    return Telemetry(
+      d['wall_time'], d['user_time'], d['system_time'], d['max_rss'], d['voluntary_context_switches'],
+      d['involuntary_context_switches'], d['processes'] if 'processes' in d else 1
+    )
+
 
 class Result:
-  def __init__(self, throughput=None, errors=None):
+  # Experiments have millions of results, which is why they do without an instance dictionary.
+  __slots__ = (
+    '_throughput', 'fork_lengths', 'errors', 'execution', 'telemetry', 'metrics', 'metric_units', 'latency'
+  )
+
+  def __init__(
+    self, throughput=None, errors=None, execution=None, telemetry=None, metrics=None, metric_units=None,
+    fork_lengths=None, latency=None
+  ):
+    # Throughput of all iterations of all forks in order; fork_lengths gives the number of iterations of each fork.
+    # For JMH's average and sample time modes, this is the reciprocal of the time per operation of each iteration.
     self.throughput = throughput if throughput else []
+    if fork_lengths is None:
+      fork_lengths = [len(self.throughput)] if self.throughput else []
+    if sum(fork_lengths) != len(self.throughput):
+      raise ValueError('Fork lengths do not add up to the number of throughput values')
+    self.fork_lengths = fork_lengths
     self.errors = errors if errors else []
+    self.execution = execution
+    self.telemetry = telemetry
+    # Secondary metrics reported by JMH profilers, e.g. gc.alloc.rate.norm, as lists of per-iteration values.
+    self.metrics = metrics if metrics else {}
+    self.metric_units = metric_units if metric_units else {}
+    # LatencyHistogram of the operation times sampled in JMH's sample time mode.
+    self.latency = latency
+
+  def __getstate__(self):
+    return {
+      'throughput': self.throughput, 'errors': self.errors, 'execution': self.execution, 'telemetry': self.telemetry,
+      'metrics': self.metrics, 'metric_units': self.metric_units, 'fork_lengths': self.fork_lengths,
+      'latency': self.latency
+    }
+
+  def __setstate__(self, state):
+    # Results pickled before slots were used carry their instance dictionary, which lacks the attributes added
+    # later on if they are older still. Results pickled before forks were recorded are treated as a single fork.
+    Result.__init__(self, **state)
+
+  @property
+  def throughput(self):
+    return self._throughput
+
+  @throughput.setter
+  def throughput(self, throughput):
+    # Unboxed doubles take a quarter of the memory of a list of floats.
+    if not isinstance(throughput, array.array) or throughput.typecode != 'd':
+      throughput = array.array('d', throughput)
+    self._throughput = throughput
+
+  @property
+  def fork_throughput(self):
+    forks = []
+    start = 0
+    for fork_length in self.fork_lengths:
+      forks.append(self.throughput[start:start + fork_length])
+      start += fork_length
+    return forks
 
   @staticmethod
   def merge(results):
-    throughput = []
+    # Throughput values are copied as a block per result.
+    throughput = array.array('d')
+    fork_lengths = []
     errors = []
+    telemetry = []
+    metrics = {}
+    metric_units = {}
+    latency = []
     for result in results:
       throughput.extend(result.throughput)
+      fork_lengths.extend(result.fork_lengths)
       errors.extend(result.errors)
-    return Result(throughput=throughput, errors=errors)
+      telemetry.append(result.telemetry)
+      for name, values in result.metrics.items():
+        metrics.setdefault(name, []).extend(values)
+      metric_units.update(result.metric_units)
+      latency.append(result.latency)
+    return Result(
+      throughput=throughput, errors=errors, telemetry=Telemetry.combine(telemetry), metrics=metrics,
+      metric_units=metric_units, fork_lengths=fork_lengths, latency=LatencyHistogram.merge(latency)
+    )
 
 
 class ExperimentResult:
+  __slots__ = ('batch', 'repetition', 'test', 'runner', 'result')
+
   def __init__(self, batch, repetition, test, runner, result):
     self.batch = batch
     self.repetition = repetition
@@ -23,6 +217,13 @@ class ExperimentResult:
     self.runner = runner
     self.result = result
 
+  def __getstate__(self):
+    return {name: getattr(self, name) for name in ExperimentResult.__slots__}
+
+  def __setstate__(self, state):
+    # Also restores results pickled with an instance dictionary, before slots were used.
+    ExperimentResult.__init__(self, **state)
+
 
 class ExperimentResults:
   def __init__(self, config, data):
@@ -59,3 +260,23 @@ class ExperimentResults:
             for rp in filtered_keys(repetitions, repetition):
               results.append(ExperimentResult(b, rp, t, rn, repetitions[rp]))
     return results
+
+  def test_costs(self):
+    # Expected wall time in seconds of one repetition of each test, summed over the runners.
+    costs = {}
+    for result in self.get_results():
+      if not result.result.throughput:
+        continue
+      runner_costs = costs.setdefault(result.test, {}).setdefault(result.runner, [])
+      if result.runner.approach == 'gradle-test':
+        runner_costs.append(sum(1 / throughput for throughput in result.result.throughput if throughput > 0))
+      else:
+        # Every sample is a measurement iteration of a fork, each of which also ran the warm-up iterations.
+        iterations = len(result.result.throughput) * (
+          (JMH_DEFAULT_WARMUP_ITERATIONS + JMH_DEFAULT_MEASUREMENT_ITERATIONS) / JMH_DEFAULT_MEASUREMENT_ITERATIONS
+        )
+        runner_costs.append(iterations * result.runner.parameter(result.test, 'time') / 1000)
+    return {
+      test: sum(sum(repetition_costs) / len(repetition_costs) for repetition_costs in runner_costs.values())
+      for test, runner_costs in costs.items()
+    }
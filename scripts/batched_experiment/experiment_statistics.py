@@ -1,36 +1,142 @@
+import itertools
 import math
 import statistics
 
 
+# Latency percentiles reported for results with a latency histogram, i.e. p50, p90, p99 and p99.9.
+LATENCY_PERCENTILES = (0.5, 0.9, 0.99, 0.999)
+
+
+def steady_state_start(values):
+  # Marginal Standard Error Rule: the truncation point d (at most half of the values) minimising the squared standard
+  # error of the mean of values[d:], which drops warm-up iterations that are far from the steady-state mean.
+  n = len(values)
+  if n < 4:
+    return 0
+  best_start = 0
+  best_score = None
+  tail_sum = 0.0
+  tail_square_sum = 0.0
+  for start in range(n - 1, -1, -1):
+    tail_sum += values[start]
+    tail_square_sum += values[start] ** 2
+    if start > n // 2:
+      continue
+    tail_length = n - start
+    squared_error_sum = tail_square_sum - tail_sum ** 2 / tail_length
+    score = squared_error_sum / tail_length ** 2
+    if best_score is None or score <= best_score:
+      best_start = start
+      best_score = score
+  return best_start
+
+
+def effective_sample_size(values):
+  # n / (1 + 2 * sum of autocorrelations), summing the initial positive autocorrelations up to half the series length.
+  n = len(values)
+  if n < 3:
+    return n
+  mean = statistics.fmean(values)
+  deviations = [value - mean for value in values]
+  autocovariance_0 = sum(d * d for d in deviations)
+  if autocovariance_0 == 0:
+    return n
+  autocorrelation_sum = 0.0
+  for lag in range(1, n // 2 + 1):
+    autocorrelation = sum(deviations[i] * deviations[i + lag] for i in range(n - lag)) / autocovariance_0
+    if autocorrelation <= 0:
+      break
+    autocorrelation_sum += autocorrelation
+  return max(1.0, min(n, n / (1 + 2 * autocorrelation_sum)))
+
+
 class ThroughputStatistics:
-  def __init__(self, result):
+  def __init__(self, result, trim_warmup=False):
     if not result.errors:
-      throughput_values = result.throughput
+      forks = result.fork_throughput
+      # Number of leading iterations of each fork before the steady state was reached.
+      self.warmup_iterations = [steady_state_start(fork) for fork in forks]
+      if trim_warmup:
+        forks = [fork[warmup:] for fork, warmup in zip(forks, self.warmup_iterations)]
+      throughput_values = list(itertools.chain.from_iterable(forks))
       self.measurements = len(throughput_values)
+      self.effective_measurements = sum(effective_sample_size(fork) for fork in forks)
       self.mean = statistics.mean(throughput_values)
-      self.variance = statistics.variance(throughput_values)
-      self.stddev = statistics.stdev(throughput_values)
-      self.stderr = self.stddev / math.sqrt(self.measurements)
-      self.cv = self.stddev / self.mean
-      # Unbiased estimator for normally distributed data.
-      self.cv_est = (1 + (1 / (4 * self.measurements))) * self.cv
+      if self.measurements > 1:
+        self.variance = statistics.variance(throughput_values)
+        self.stddev = statistics.stdev(throughput_values)
+        # Autocorrelated iterations within a fork carry less information than independent measurements.
+        self.stderr = self.stddev / math.sqrt(self.effective_measurements)
+        self.cv = self.stddev / self.mean
+        # Unbiased estimator for normally distributed data.
+        self.cv_est = (1 + (1 / (4 * self.measurements))) * self.cv
+      else:
+        # A single measurement, e.g. of a test overridden to one execution, has no spread.
+        self.variance = None
+        self.stddev = None
+        self.stderr = None
+        self.cv = None
+        self.cv_est = None
+      self.metrics = {
+        name: MetricStatistics(values, result.metric_units.get(name)) for name, values in result.metrics.items()
+      }
+      latency = result.latency
+      self.latency_unit = latency.unit if latency is not None else None
+      # Percentiles of the sampled operation times, {0.99: value}; empty unless the result has a latency histogram.
+      self.latency_percentiles = (
+        {fraction: latency.percentile(fraction) for fraction in LATENCY_PERCENTILES}
+        if latency is not None and latency.total else {}
+      )
     else:
+      self.warmup_iterations = None
       self.measurements = None
+      self.effective_measurements = None
       self.mean = None
       self.variance = None
       self.stddev = None
       self.stderr = None
       self.cv = None
       self.cv_est = None
+      self.metrics = {}
+      self.latency_unit = None
+      self.latency_percentiles = {}
+
+  def relative_ci_width(self, confidence=0.95):
+    # Width of the normal approximation confidence interval of the mean, relative to the mean.
+    if self.stderr is None:
+      return None
+    z = statistics.NormalDist().inv_cdf(0.5 + confidence / 2)
+    return 2 * z * self.stderr / self.mean
+
+
+class MetricStatistics:
+  def __init__(self, values, unit=None):
+    self.unit = unit
+    self.measurements = len(values)
+    self.mean = statistics.mean(values)
+    if self.measurements > 1:
+      self.variance = statistics.variance(values)
+      self.stddev = statistics.stdev(values)
+      self.stderr = self.stddev / math.sqrt(self.measurements)
+      self.cv = self.stddev / self.mean if self.mean else None
+    else:
+      self.variance = None
+      self.stddev = None
+      self.stderr = None
+      self.cv = None
 
 class ExperimentStatistics:
-  def __init__(self, results, separate, combined):
+  def __init__(self, results, separate, combined, variance_components=None):
     self._results = results
     self._separate = separate
     self._combined = combined
+    self._variance_components = variance_components
 
   @staticmethod
-  def from_experiment_results(experiment_results, progress_callback=None):
+  def from_experiment_results(
+    experiment_results, progress_callback=None, trim_warmup=False, variance_components=None
+  ):
+    # variance_components optionally maps (batch, test, runner) to VarianceComponents, see variance_decomposition.
     separate_results = experiment_results.get_results(combine_repetitions=False)
     separate_statistics = {}
     combined_statistics = {}
@@ -39,20 +145,24 @@ class ExperimentStatistics:
         progress_callback(current_separate=i, total_separate=len(separate_results))
       result = separate_results[i]
       key = (result.batch, result.repetition, result.test, result.runner)
-      separate_statistics[key] = ThroughputStatistics(result.result)
+      separate_statistics[key] = ThroughputStatistics(result.result, trim_warmup=trim_warmup)
     combined_results = experiment_results.get_results(combine_repetitions=True)
     for i in range(len(combined_results)):
       if progress_callback:
         progress_callback(current_combined=i, total_combined=len(combined_results))
       result = combined_results[i]
       key = (result.batch, result.test, result.runner)
-      combined_statistics[key] = ThroughputStatistics(result.result)
-    return ExperimentStatistics(experiment_results, separate_statistics, combined_statistics)
+      combined_statistics[key] = ThroughputStatistics(result.result, trim_warmup=trim_warmup)
+    return ExperimentStatistics(experiment_results, separate_statistics, combined_statistics, variance_components)
 
   @property
   def config(self):
     return self._results.config
 
+  @property
+  def results(self):
+    return self._results
+
   def get_results(self, batch=None, repetition=None, test=None, runner=None, combine_repetitions=False):
     results = self._results.get_results(
       batch=batch, repetition=repetition, test=test, runner=runner,
@@ -64,3 +174,10 @@ class ExperimentStatistics:
       else:
         return self._combined[result.batch, result.test, result.runner]
     return [(result, get_statistics(result)) for result in results]
+
+  def get_variance_components(self, batch, test, runner):
+    # Statistics pickled before variance components were supported lack the attribute.
+    variance_components = getattr(self, '_variance_components', None)
+    if variance_components is None:
+      return None
+    return variance_components.get((batch, test, runner))
@@ -0,0 +1,54 @@
+import json
+import re
+
+
+from batched_experiment.config import JMH_BENCHMARK_MODES
+
+
+_decoder = json.JSONDecoder()
+# A string followed by a colon is an object key, since quotes inside strings are escaped. JMH writes the mode before
+# the parameters and the primary metric before the secondary metrics, so the first match of each belongs to the
+# first benchmark, which is the one read from per-benchmark output files.
+_mode_key = re.compile(r'"mode"\s*:\s*')
+_primary_metric_key = re.compile(r'"primaryMetric"\s*:\s*')
+
+
+def _decode_value(text, key_pattern, start=0):
+  match = key_pattern.search(text, start)
+  if match is None:
+    return None, start
+  value, end = _decoder.raw_decode(text, match.end())
+  return value, end
+
+
+def extract_benchmark_output(text):
+  # Decodes only the mode and the primary metric of the first benchmark of a JMH JSON result, skipping the run
+  # parameters, the secondary metrics and anything else. Returns None if the text does not have the expected layout,
+  # in which case it should be parsed in full.
+  if not text.lstrip().startswith('['):
+    return None
+  try:
+    mode, end = _decode_value(text, _mode_key)
+    primary_metric, end = _decode_value(text, _primary_metric_key, end)
+  except ValueError:
+    return None
+  if mode not in JMH_BENCHMARK_MODES or not isinstance(primary_metric, dict):
+    return None
+  if 'rawData' not in primary_metric and 'rawDataHistogram' not in primary_metric:
+    return None
+  return {'mode': mode, 'primaryMetric': primary_metric}
+
+
+def read_benchmark_output(path, secondary_metrics=True):
+  with open(path, 'r') as f:
+    return parse_benchmark_output(f.read(), secondary_metrics)
+
+
+def parse_benchmark_output(text, secondary_metrics=True):
+  # Secondary metrics are mostly raw data, which takes as long to decode selectively as the whole file does, so the
+  # output is only skimmed if they are not needed. Unexpected or malformed output is left to the full parser, which
+  # reports errors as before.
+  benchmark_output = extract_benchmark_output(text) if not secondary_metrics else None
+  if benchmark_output is None:
+    benchmark_output = json.loads(text)[0]
+  return benchmark_output
@@ -0,0 +1,95 @@
+import org.junit.runner.Description;
+import org.junit.runner.JUnitCore;
+import org.junit.runner.Request;
+import org.junit.runner.notification.Failure;
+import org.junit.runner.notification.RunListener;
+
+import java.io.BufferedReader;
+import java.io.FileDescriptor;
+import java.io.FileOutputStream;
+import java.io.IOException;
+import java.io.InputStreamReader;
+import java.io.PrintStream;
+import java.util.HashMap;
+import java.util.Map;
+
+/**
+ * Resident JUnit 4 launcher used by the batched experiment scripts.
+ *
+ * Reads one test per line from standard input, formatted as {@code <class name>\t<method name>}, runs it and writes
+ * the duration of the test in nanoseconds, or {@code FAILED}, as one line to standard output. Output produced by the
+ * tests themselves is redirected to standard error so that it does not interfere with the protocol.
+ */
+public class JUnitLauncher {
+
+    private static class TimingListener extends RunListener {
+        private long startTime;
+        private long duration = -1;
+        private boolean failed = false;
+
+        @Override
+        public void testStarted(Description description) {
+            startTime = System.nanoTime();
+        }
+
+        @Override
+        public void testFinished(Description description) {
+            duration = System.nanoTime() - startTime;
+        }
+
+        @Override
+        public void testFailure(Failure failure) {
+            failed = true;
+        }
+
+        @Override
+        public void testAssumptionFailure(Failure failure) {
+            failed = true;
+        }
+    }
+
+    private final Map<String, Class<?>> testClasses = new HashMap<>();
+
+    private Class<?> loadTestClass(String className) throws ClassNotFoundException {
+        Class<?> testClass = testClasses.get(className);
+        if (testClass == null) {
+            testClass = Class.forName(className, false, JUnitLauncher.class.getClassLoader());
+            testClasses.put(className, testClass);
+        }
+        return testClass;
+    }
+
+    private String runTest(String className, String methodName) {
+        Class<?> testClass;
+        try {
+            testClass = loadTestClass(className);
+        } catch (ClassNotFoundException | LinkageError e) {
+            e.printStackTrace();
+            return "FAILED";
+        }
+        JUnitCore core = new JUnitCore();
+        TimingListener listener = new TimingListener();
+        core.addListener(listener);
+        core.run(Request.method(testClass, methodName));
+        if (listener.failed || listener.duration < 0) {
+            return "FAILED";
+        }
+        return Long.toString(listener.duration);
+    }
+
+    public static void main(String[] args) throws IOException {
+        PrintStream protocolOut = new PrintStream(new FileOutputStream(FileDescriptor.out), true);
+        System.setOut(System.err);
+        BufferedReader in = new BufferedReader(new InputStreamReader(System.in));
+        JUnitLauncher launcher = new JUnitLauncher();
+        String line;
+        while ((line = in.readLine()) != null) {
+            String[] test = line.split("\t", 2);
+            if (test.length != 2) {
+                protocolOut.println("FAILED");
+                continue;
+            }
+            protocolOut.println(launcher.runTest(test[0], test[1]));
+        }
+    }
+}
@@ -0,0 +1,81 @@
+import org.junit.platform.engine.TestExecutionResult;
+import org.junit.platform.engine.TestSource;
+import org.junit.platform.engine.support.descriptor.MethodSource;
+import org.junit.platform.launcher.TestExecutionListener;
+import org.junit.platform.launcher.TestIdentifier;
+
+import java.io.IOException;
+import java.io.UncheckedIOException;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.Files;
+import java.nio.file.Path;
+import java.nio.file.Paths;
+import java.nio.file.StandardOpenOption;
+import java.util.Map;
+import java.util.concurrent.ConcurrentHashMap;
+
+/**
+ * JUnit Platform listener used by the batched experiment scripts' test-timing.gradle init script.
+ *
+ * Registered through the service loader in the test JVM, it measures the duration of every test method there and
+ * appends it to the file given by the {@code testTimingFile} system property, as one line per test formatted as
+ * {@code <class name>\t<method name>\t<result type>\t<duration in nanoseconds>}. Result types are those of Gradle's
+ * test results: SUCCESS, FAILURE or SKIPPED.
+ */
+public class TestTimingListener implements TestExecutionListener {
+
+    private final String timingFile = System.getProperty("testTimingFile");
+    private final Map<String, Long> startTimes = new ConcurrentHashMap<>();
+
+    @Override
+    public void executionStarted(TestIdentifier testIdentifier) {
+        if (timingFile != null && testIdentifier.isTest()) {
+            startTimes.put(testIdentifier.getUniqueId(), System.nanoTime());
+        }
+    }
+
+    @Override
+    public void executionFinished(TestIdentifier testIdentifier, TestExecutionResult testExecutionResult) {
+        Long startTime = startTimes.remove(testIdentifier.getUniqueId());
+        if (startTime == null) {
+            return;
+        }
+        long duration = System.nanoTime() - startTime;
+        TestSource source = testIdentifier.getSource().orElse(null);
+        if (!(source instanceof MethodSource)) {
+            return;
+        }
+        MethodSource method = (MethodSource) source;
+        String line = method.getClassName() + "\t" + method.getMethodName() + "\t"
+                + resultType(testExecutionResult.getStatus()) + "\t" + duration + "\n";
+        append(line);
+    }
+
+    @Override
+    public void executionSkipped(TestIdentifier testIdentifier, String reason) {
+        startTimes.remove(testIdentifier.getUniqueId());
+    }
+
+    private static String resultType(TestExecutionResult.Status status) {
+        switch (status) {
+            case SUCCESSFUL:
+                return "SUCCESS";
+            case ABORTED:
+                return "SKIPPED";
+            default:
+                return "FAILURE";
+        }
+    }
+
+    private void append(String line) {
+        // A single appending write per line, so that lines of test JVMs running in parallel are not interleaved.
+        Path path = Paths.get(timingFile);
+        try {
+            Files.write(
+                    path, line.getBytes(StandardCharsets.UTF_8), StandardOpenOption.CREATE, StandardOpenOption.APPEND
+            );
+        } catch (IOException e) {
+            throw new UncheckedIOException(e);
+        }
+    }
+}
@@ -0,0 +1,118 @@
+import math
+import statistics
+
+
+from batched_experiment.config import (
+  JMH_DEFAULT_MEASUREMENT_ITERATIONS, JMH_DEFAULT_WARMUP_ITERATIONS, JmhRunnerConfiguration
+)
+
+
+DEFAULT_FORK_CHOICES = tuple(range(1, 11))
+# Iteration times considered, relative to the iteration time of the experiment the variance was measured in.
+DEFAULT_TIME_FACTORS = (0.5, 1, 2, 4, 8)
+DEFAULT_MAX_REPETITIONS = 20
+
+
+class MeasurementPlan:
+  def __init__(self, test, runner, forks, time, repetitions, cost, relative_ci_width, target_reached):
+    self.test = test
+    self.runner = runner
+    self.forks = forks
+    self.time = time
+    self.repetitions = repetitions
+    # Expected machine time in seconds over all repetitions.
+    self.cost = cost
+    self.relative_ci_width = relative_ci_width
+    self.target_reached = target_reached
+
+  def overrides(self):
+    return {'forks': self.forks, 'time': self.time, 'repetitions': self.repetitions}
+
+
+class MeasurementPlanner:
+  def __init__(
+    self, variance_components, jvm_startup, confidence=0.95, fork_choices=DEFAULT_FORK_CHOICES,
+    time_factors=DEFAULT_TIME_FACTORS, max_repetitions=DEFAULT_MAX_REPETITIONS
+  ):
+    # Variance components of JMH results per (batch, test, runner), see variance_decomposition.decompose_variance.
+    self.variance_components = {
+      key: components for key, components in variance_components.items()
+      if isinstance(key[2], JmhRunnerConfiguration) and components.mean
+    }
+    self.jvm_startup = jvm_startup
+    self.z = statistics.NormalDist().inv_cdf(0.5 + confidence / 2)
+    self.fork_choices = fork_choices
+    self.time_factors = time_factors
+    self.max_repetitions = max_repetitions
+
+  def repetition_variance(self, components, measured_time, forks, time):
+    # Variance of the mean of a single repetition. Components that could not be estimated, because the measured
+    # experiment had a single fork or repetition, are contained in the next level up and contribute nothing here.
+    # The variance of an iteration is assumed to be inversely proportional to the iteration time, measured_time being
+    # the iteration time the test was measured with.
+    iteration_variance = (components.iteration or 0) * measured_time / time
+    return (
+      (components.repetition or 0) + (components.fork or 0) / forks
+      + iteration_variance / (forks * JMH_DEFAULT_MEASUREMENT_ITERATIONS)
+    )
+
+  def relative_ci_width(self, components, measured_time, forks, time, repetitions):
+    variance = self.repetition_variance(components, measured_time, forks, time) / repetitions
+    return 2 * self.z * math.sqrt(variance) / abs(components.mean)
+
+  def cost(self, forks, time, repetitions):
+    iterations = JMH_DEFAULT_WARMUP_ITERATIONS + JMH_DEFAULT_MEASUREMENT_ITERATIONS
+    # JMH starts one JVM for the harness and one for every fork.
+    return repetitions * (self.jvm_startup + forks * (iterations * time / 1000 + self.jvm_startup))
+
+  def plan_test(self, key, target_width):
+    _, test, runner = key
+    components = self.variance_components[key]
+    measured_time = runner.parameter(test, 'time')
+    # The variance of the mean shrinks with 1/repetitions, so the repetitions needed for a target width of the
+    # confidence interval follow directly from the variance of a single repetition.
+    target_variance = (target_width * abs(components.mean) / (2 * self.z)) ** 2
+    best = None
+    closest = None
+    for forks in self.fork_choices:
+      for time in sorted({max(1, round(measured_time * factor)) for factor in self.time_factors}):
+        variance = self.repetition_variance(components, measured_time, forks, time)
+        repetitions = max(1, math.ceil(variance / target_variance)) if target_variance > 0 else math.inf
+        if repetitions <= self.max_repetitions:
+          candidate = (self.cost(forks, time, repetitions), forks, time, repetitions)
+          if best is None or candidate < best:
+            best = candidate
+        else:
+          width = self.relative_ci_width(components, measured_time, forks, time, self.max_repetitions)
+          candidate = (width, self.cost(forks, time, self.max_repetitions), forks, time)
+          if closest is None or candidate < closest:
+            closest = candidate
+    if best is not None:
+      cost, forks, time, repetitions = best
+      width = self.relative_ci_width(components, measured_time, forks, time, repetitions)
+      return MeasurementPlan(test, runner, forks, time, repetitions, cost, width, True)
+    width, cost, forks, time = closest
+    return MeasurementPlan(test, runner, forks, time, self.max_repetitions, cost, width, False)
+
+  def plan(self, target_width):
+    return {key: self.plan_test(key, target_width) for key in self.variance_components}
+
+  def plan_within_budget(self, target_width, budget, search_steps=30):
+    # Relaxes the target width for all tests alike until the total cost fits the budget (in seconds).
+    plans = self.plan(target_width)
+    if budget is None or sum(plan.cost for plan in plans.values()) <= budget:
+      return plans, target_width
+    low = math.log(target_width)
+    high = math.log(target_width * 1e3)
+    relaxed_plans = self.plan(math.exp(high))
+    if sum(plan.cost for plan in relaxed_plans.values()) > budget:
+      return relaxed_plans, math.exp(high)
+    for _ in range(search_steps):
+      middle = (low + high) / 2
+      middle_plans = self.plan(math.exp(middle))
+      if sum(plan.cost for plan in middle_plans.values()) <= budget:
+        high = middle
+        relaxed_plans = middle_plans
+      else:
+        low = middle
+    return relaxed_plans, math.exp(high)
@@ -0,0 +1,164 @@
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+
+
+from batched_experiment.config import JmhRunnerConfiguration
+from batched_experiment.error import BenchmarkExecutionFailedError
+from batched_experiment.execution import STATUS_COMPLETED, run_process
+from batched_experiment.runner import ExperimentRunner
+
+
+# Stack frames printed per execution sample; JFR prints only the top 5 frames by default, which hides callers.
+JFR_STACK_DEPTH = 64
+
+
+def jfr_executable(java):
+  # The jfr tool of the JDK that the benchmarks run on, which can read its recordings; java may be on the PATH and be
+  # a link into the JDK.
+  java_path = shutil.which(java)
+  if java_path is None:
+    raise BenchmarkExecutionFailedError('Could not find {}'.format(java))
+  jfr = shutil.which('jfr', path=os.path.dirname(os.path.realpath(java_path)))
+  if jfr is None:
+    raise BenchmarkExecutionFailedError('The JDK of {} has no jfr tool'.format(java_path))
+  return jfr
+
+
+class MethodProfile:
+  def __init__(self, samples, self_samples, total_samples):
+    self.samples = samples
+    self.self_samples = self_samples
+    self.total_samples = total_samples
+
+  @staticmethod
+  def _method_name(frame):
+    method = frame['method']
+    return '{}.{}'.format(method['type']['name'].replace('/', '.'), method['name'])
+
+  @staticmethod
+  def from_execution_samples(events):
+    samples = 0
+    self_samples = {}
+    total_samples = {}
+    for event in events:
+      stack_trace = event['values']['stackTrace']
+      if not stack_trace or not stack_trace['frames']:
+        continue
+      samples += 1
+      methods = [MethodProfile._method_name(frame) for frame in stack_trace['frames']]
+      # The first frame is the one that was executing when the sample was taken.
+      self_samples[methods[0]] = self_samples.get(methods[0], 0) + 1
+      # Recursive methods appear in a stack more than once but are counted once per sample.
+      for method in set(methods):
+        total_samples[method] = total_samples.get(method, 0) + 1
+    return MethodProfile(samples, self_samples, total_samples)
+
+  @staticmethod
+  def from_recording(recording_file, jfr='jfr'):
+    process = subprocess.run(
+      [
+        jfr, 'print', '--json', '--events', 'jdk.ExecutionSample', '--stack-depth', str(JFR_STACK_DEPTH),
+        recording_file
+      ],
+      stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True
+    )
+    if process.returncode != 0:
+      raise BenchmarkExecutionFailedError('Could not read the flight recording {}'.format(recording_file))
+    return MethodProfile.from_execution_samples(json.loads(process.stdout)['recording']['events'])
+
+  def self_time(self, method):
+    # Fraction of the samples in which the method itself was executing.
+    return self.self_samples.get(method, 0) / self.samples if self.samples else 0.0
+
+  def total_time(self, method):
+    # Fraction of the samples in which the method was on the stack.
+    return self.total_samples.get(method, 0) / self.samples if self.samples else 0.0
+
+
+class HotMethodDifference:
+  def __init__(self, method, baseline_self_time, comparison_self_time, baseline_total_time, comparison_total_time):
+    self.method = method
+    self.baseline_self_time = baseline_self_time
+    self.comparison_self_time = comparison_self_time
+    self.baseline_total_time = baseline_total_time
+    self.comparison_total_time = comparison_total_time
+
+  @property
+  def self_time_difference(self):
+    return self.comparison_self_time - self.baseline_self_time
+
+  @property
+  def total_time_difference(self):
+    return self.comparison_total_time - self.baseline_total_time
+
+
+def hot_method_diff(baseline_profile, comparison_profile, top=None):
+  # Methods ranked by how much more of the comparison's time they take, i.e. the likely location of a slowdown first.
+  methods = set(baseline_profile.total_samples) | set(comparison_profile.total_samples)
+  differences = [
+    HotMethodDifference(
+      method, baseline_profile.self_time(method), comparison_profile.self_time(method),
+      baseline_profile.total_time(method), comparison_profile.total_time(method)
+    )
+    for method in methods
+  ]
+  differences.sort(key=lambda d: (-d.self_time_difference, -d.total_time_difference, d.method))
+  return differences[:top] if top is not None else differences
+
+
+class JfrProfiler:
+  def __init__(self, output_dir, forks=1):
+    self.output_dir = os.path.abspath(output_dir)
+    self.forks = forks
+
+  def recording_file(self, runner_config, test, role):
+    return os.path.join(
+      self.output_dir, runner_config.name, '{}.{}'.format(test.class_name, test.method_name), '{}.jfr'.format(role)
+    )
+
+  def record(self, runner_config, test, role):
+    runner = ExperimentRunner._create_runner(runner_config)
+    recording_file = self.recording_file(runner_config, test, role)
+    os.makedirs(os.path.dirname(recording_file), exist_ok=True)
+    if os.path.exists(recording_file):
+      os.remove(recording_file)
+    # The iteration time of the measured runs, so that the profile shows the same warm-up and measurement.
+    time = runner_config.parameter(test, 'time')
+    benchmark_command = runner.benchmark_command(
+      runner.benchmark_regex(test), os.path.join(os.path.dirname(recording_file), '{}_output.json'.format(role)),
+      forks=self.forks, iteration_time=time,
+      jvm_args=['-XX:StartFlightRecording=settings=profile,dumponexit=true,filename={}'.format(recording_file)]
+    )
+    process_result = asyncio.run(run_process(
+      benchmark_command, timeout=runner_config.benchmark_time_budget(forks=self.forks, time=time),
+      log_file=os.path.join(os.path.dirname(recording_file), '{}_stderr.log'.format(role))
+    ))
+    if process_result.status != STATUS_COMPLETED or not os.path.exists(recording_file):
+      raise BenchmarkExecutionFailedError('Could not record {}.{}'.format(test.class_name, test.method_name))
+    return recording_file
+
+  def profile(self, runner_config, test, role):
+    # Configurations pickled before the JVM could be configured lack the attribute.
+    jfr = jfr_executable(getattr(runner_config, 'java', 'java'))
+    return MethodProfile.from_recording(self.record(runner_config, test, role), jfr)
+
+
+def profile_slowdowns(comparison_results, profiler, top=None, progress_callback=None):
+  # Only JMH benchmarks can be re-run in isolation; the diff is attached to the significant comparisons.
+  flagged = [
+    result for result in comparison_results
+    if isinstance(result.runner, JmhRunnerConfiguration)
+    and result.binomial_test_result is not None and result.binomial_test_result < result.alpha
+  ]
+  for i, result in enumerate(flagged):
+    if progress_callback:
+      progress_callback(current=i, total=len(flagged))
+    try:
+      baseline_profile = profiler.profile(result.runner, result.comparison.baseline, 'baseline')
+      comparison_profile = profiler.profile(result.runner, result.comparison.comparison, 'comparison')
+    except BenchmarkExecutionFailedError:
+      continue
+    result.hot_method_diff = hot_method_diff(baseline_profile, comparison_profile, top=top)
@@ -1,106 +1,449 @@
+import asyncio
 import json
 import os
+import queue
 import re
+import select
 import subprocess
 import shutil
+import socket
+import threading
+import time
 import xml.etree.ElementTree
 
 
 from batched_experiment._util import clear_console_line
+from batched_experiment.config import Test
+from batched_experiment.data_collector import ExperimentDataCollector
 from batched_experiment.error import BenchmarkExecutionFailedError
+from batched_experiment.estimate import ExperimentCostEstimator, format_duration
+from batched_experiment.execution import (
+  STATUS_TIMEOUT, create_slots, kill_process_tree, run_in_slots, run_process, wait_for_process
+)
+from batched_experiment.experiment_data import Result
+from batched_experiment.experiment_statistics import ThroughputStatistics
+from batched_experiment.work_queue import LeaseHeartbeat, WorkQueue, default_worker_id
+
+
+_launcher_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'launcher')
 
 
 class GradleTestRunner:
+  timing_init_script = os.path.join(_launcher_dir, 'test-timing.gradle')
+
   def __init__(self, config):
+    self.config = config
     self.name = config.name
     self.project_root = config.project_root
     self.gradlew = os.path.join(self.project_root, 'gradlew.bat' if os.name == 'nt' else 'gradlew')
     self.subproject_path = config.subproject_path
-    subproject_root = os.path.join(self.project_root, *self.subproject_path)
-    self.test_results_root = os.path.join(subproject_root, 'build', 'test-results', 'test')
-    self.build_test_tmp_dir = os.path.join(subproject_root, 'build', 'tmp', 'test')
+    self.subproject_root = os.path.join(self.project_root, *self.subproject_path)
+    self.test_results_root = os.path.join(self.subproject_root, 'build', 'test-results', 'test')
+    self.build_test_tmp_dir = os.path.join(self.subproject_root, 'build', 'tmp', 'test')
     self.executions = config.executions
+    self.timeout = config.timeout
     self.output_file = config.output_file
+    self.log_file = config.log_file
+    self.telemetry_file = config.telemetry_file
 
   def run_batch(self, tests, output_dir, logging_context=''):
     test_durations = {test: [] for test in tests}
+    test_durations_ns = {test: [] for test in tests}
+    telemetry = []
+    # Absolute, as it is written by the test JVM, which does not share the working directory.
+    timing_file = os.path.abspath(os.path.join(output_dir, '{}_timing.tsv'.format(self.name)))
+    if os.path.exists(timing_file):
+      # Left behind by an interrupted run of this batch.
+      os.remove(timing_file)
     gradle_command = ':'.join(('', *self.subproject_path, 'test'))
-    unit_test_command = [self.gradlew, gradle_command]
-    for test in tests:
-      qualified_test_name = '{}.{}'.format(test.class_name, test.method_name)
-      unit_test_command.extend(['--tests', qualified_test_name])
-    for i in range(self.executions):
-      print('{} [{} {:d}/{:d}] gradlew {}'.format(logging_context, self.name, i + 1, self.executions, gradle_command))
-      subprocess.run(
-        unit_test_command, cwd=self.project_root,
-        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
-      )
+    executions = self.test_executions(tests)
+    for i in range(executions):
+      # Tests with fewer executions than the runner are left out of the later executions.
+      execution_tests = [test for test in tests if i < self.config.parameter(test, 'executions')]
+      # Without a daemon, the build and the test JVMs are descendants of the gradlew process, so that its telemetry
+      # covers them rather than the client alone, and a timeout kills them along with it.
+      unit_test_command = [
+        self.gradlew, '--no-daemon', '-I', self.timing_init_script, '-PtestTimingFile={}'.format(timing_file),
+        gradle_command
+      ]
+      for test in execution_tests:
+        qualified_test_name = '{}.{}'.format(test.class_name, test.method_name)
+        unit_test_command.extend(['--tests', qualified_test_name])
+      print('{} [{} {:d}/{:d}] gradlew {}'.format(logging_context, self.name, i + 1, executions, gradle_command))
+      process_result = asyncio.run(run_process(
+        unit_test_command, timeout=self.execution_timeout(execution_tests),
+        log_file=os.path.join(output_dir, self.log_file), cwd=self.project_root
+      ))
+      telemetry.append(process_result.telemetry)
       clear_console_line()
-      print('{} [{} {:d}/{:d}] reading output'.format(logging_context, self.name, i + 1, self.executions))
-      for test in tests:
+      print('{} [{} {:d}/{:d}] reading output'.format(logging_context, self.name, i + 1, executions))
+      test_timings = self.read_test_timings(timing_file)
+      for test in execution_tests:
+        if process_result.status == STATUS_TIMEOUT:
+          test_durations[test].append(STATUS_TIMEOUT)
+          test_durations_ns[test].append(STATUS_TIMEOUT)
+          continue
+        if test_timings is not None:
+          # Tests missing from the timing file did not run, e.g. because of a compilation failure.
+          duration_ns = test_timings.get(test, 'FAILED')
+          test_durations[test].append(duration_ns if duration_ns == 'FAILED' else duration_ns / 1e9)
+          test_durations_ns[test].append(duration_ns)
+          continue
         try:
           test_duration = self.get_test_execution_time(test)
           test_durations[test].append(test_duration)
         except BenchmarkExecutionFailedError:
           test_durations[test].append('FAILED')
+        test_durations_ns[test].append(None)
       clear_console_line()
     if os.path.exists(self.build_test_tmp_dir):
       # Delete build/tmp/test to prevent it from growing indefinitely.
       shutil.rmtree(self.build_test_tmp_dir)
-    output = [
-      {'class': test.class_name, 'test': test.method_name, 'test_durations': test_durations[test]}
-      for test in test_durations
-    ]
+    self.write_telemetry(telemetry, output_dir)
+    self.write_output(test_durations, output_dir, test_durations_ns=test_durations_ns)
+
+  def test_executions(self, tests):
+    return max((self.config.parameter(test, 'executions') for test in tests), default=0)
+
+  def execution_timeout(self, tests):
+    # A Gradle invocation runs all given tests, so it gets the longest of their timeouts.
+    timeouts = [self.config.parameter(test, 'timeout') for test in tests]
+    if None in timeouts:
+      return None
+    return max(timeouts, default=None)
+
+  def write_output(self, test_durations, output_dir, test_durations_ns=None):
+    output = []
+    for test in test_durations:
+      test_output = {'class': test.class_name, 'test': test.method_name, 'test_durations': test_durations[test]}
+      if test_durations_ns is not None and None not in test_durations_ns[test]:
+        test_output['test_durations_ns'] = test_durations_ns[test]
+      output.append(test_output)
     output_file = os.path.join(output_dir, self.output_file)
     with open(output_file, 'w') as f:
       json.dump(output, f, indent=4)
 
+  def write_telemetry(self, telemetry, output_dir):
+    with open(os.path.join(output_dir, self.telemetry_file), 'w') as f:
+      json.dump([process_telemetry.to_dict() for process_telemetry in telemetry], f, indent=4)
+
+  def read_test_timings(self, timing_file):
+    if not os.path.exists(timing_file):
+      return None
+    test_timings = {}
+    with open(timing_file, 'r') as f:
+      for line in f:
+        class_name, method_name, result_type, duration_ns = line.rstrip('\n').split('\t')
+        test_timings[Test(class_name, method_name)] = 'FAILED' if result_type == 'FAILURE' else int(duration_ns)
+    os.remove(timing_file)
+    return test_timings
+
   def get_test_execution_time(self, test):
     results_file = os.path.join(self.test_results_root, 'TEST-{}.xml'.format(test.class_name))
     test_cases = xml.etree.ElementTree.parse(results_file).getroot().findall('testcase')
     for test_case in test_cases:
       if test_case.get('name') == test.method_name:
-        if test_case.find('failure'):
+        if test_case.find('failure') is not None:
           raise BenchmarkExecutionFailedError()
         return test_case.get('time')
 
 
+class DirectJUnitTestRunner(GradleTestRunner):
+  launcher_source = os.path.join(_launcher_dir, 'JUnitLauncher.java')
+  classpath_init_script = os.path.join(_launcher_dir, 'test-classpath.gradle')
+  classpath_prefix = 'TEST_RUNTIME_CLASSPATH='
+
+  def __init__(self, config):
+    super().__init__(config)
+    self.classpath = None
+
+  def resolve_classpath(self):
+    gradle_command = ':'.join(('', *self.subproject_path, 'printTestRuntimeClasspath'))
+    classpath_command = [self.gradlew, '-q', '-I', self.classpath_init_script, gradle_command]
+    process = subprocess.Popen(
+      classpath_command, cwd=self.project_root, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+      start_new_session=True
+    )
+    try:
+      stdout, _ = process.communicate(timeout=self.timeout)
+    except subprocess.TimeoutExpired:
+      # The whole process group is killed, as the Gradle client started by the wrapper also holds on to the pipe.
+      kill_process_tree(process)
+      process.communicate()
+      raise BenchmarkExecutionFailedError('Resolving the test runtime classpath of {} timed out'.format(self.name))
+    for line in stdout.splitlines():
+      if line.startswith(self.classpath_prefix):
+        return line[len(self.classpath_prefix):]
+    raise BenchmarkExecutionFailedError('Could not resolve the test runtime classpath of {}'.format(self.name))
+
+  def run_batch(self, tests, output_dir, logging_context=''):
+    if self.classpath is None:
+      print('{} [{}] gradlew printTestRuntimeClasspath'.format(logging_context, self.name))
+      self.classpath = self.resolve_classpath()
+      clear_console_line()
+    test_durations = {test: [] for test in tests}
+    test_durations_ns = {test: [] for test in tests}
+    telemetry = []
+    with open(os.path.join(output_dir, self.log_file), 'a') as log:
+      launcher = None
+      executions = self.test_executions(tests)
+      for i in range(executions):
+        print('{} [{} {:d}/{:d}] JUnit launcher'.format(logging_context, self.name, i + 1, executions))
+        for test in tests:
+          if i >= self.config.parameter(test, 'executions'):
+            continue
+          if launcher is None:
+            launcher, launcher_start_time = self.start_launcher(log)
+          duration_ns, launcher_killed = self.run_test(launcher, test, self.config.parameter(test, 'timeout'))
+          if launcher_killed:
+            # The launcher timed out or died, e.g. because a test called System.exit; start a fresh one for the
+            # remaining tests.
+            telemetry.append(wait_for_process(launcher, launcher_start_time))
+            launcher = None
+          test_durations[test].append(duration_ns if isinstance(duration_ns, str) else duration_ns / 1e9)
+          test_durations_ns[test].append(duration_ns)
+        clear_console_line()
+      if launcher is not None:
+        try:
+          launcher.stdin.close()
+        except BrokenPipeError:
+          # The launcher died after the last test.
+          pass
+        telemetry.append(wait_for_process(launcher, launcher_start_time))
+    self.write_telemetry(telemetry, output_dir)
+    self.write_output(test_durations, output_dir, test_durations_ns=test_durations_ns)
+
+  def start_launcher(self, log):
+    launcher_command = ['java', '-cp', self.classpath, self.launcher_source]
+    start_time = time.monotonic()
+    launcher = subprocess.Popen(
+      launcher_command, cwd=self.subproject_root,
+      stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=log, text=True, start_new_session=True
+    )
+    return launcher, start_time
+
+  def run_test(self, launcher, test, timeout):
+    # Returns the duration of the test and whether the launcher was killed, which it is after a timeout or once it
+    # has died.
+    try:
+      launcher.stdin.write('{}\t{}\n'.format(test.class_name, test.method_name))
+      launcher.stdin.flush()
+    except BrokenPipeError:
+      kill_process_tree(launcher)
+      return 'FAILED', True
+    response = self.read_response(launcher, timeout)
+    if response is None:
+      kill_process_tree(launcher)
+      return STATUS_TIMEOUT, True
+    if not response:
+      # End of output, the launcher died while running the test.
+      kill_process_tree(launcher)
+      return 'FAILED', True
+    response = response.strip()
+    if not response or response == 'FAILED':
+      return 'FAILED', False
+    return int(response), False
+
+  def read_response(self, launcher, timeout):
+    # The next line written by the launcher, or None if there is none within the timeout.
+    if os.name != 'nt':
+      ready, _, _ = select.select([launcher.stdout], [], [], timeout)
+      return launcher.stdout.readline() if ready else None
+    # select does not support pipes on Windows, so the line is read by a thread, which ends once the launcher is
+    # killed after a timeout.
+    lines = queue.Queue()
+    threading.Thread(target=lambda: lines.put(launcher.stdout.readline()), daemon=True).start()
+    try:
+      return lines.get(timeout=timeout)
+    except queue.Empty:
+      return None
+
+
 class JmhBenchmarkRunner:
   def __init__(self, config):
     self.config = config
     self.name = config.name
     self.jar = config.jar
     self.forks = config.forks
+    self.slots = create_slots(config)
 
   def benchmark_regex(self, test):
     regex = re.escape('{}.{}'.format(test.class_name, test.method_name))
     return '^{}$'.format(regex)
 
-  def run_batch(self, tests, output_dir, logging_context=''):
-    for i in range(len(tests)):
-      test = tests[i]
-      print('{} [{} {:d}/{:d}] {}'.format(
-        logging_context, self.config.name, i + 1, len(tests), '{}.{}'.format(test.class_name, test.method_name)
-      ))
-      self.run_benchmark(test, output_dir)
+  def batch_regex(self, tests):
+    return '|'.join('(?:{})'.format(self.benchmark_regex(test)) for test in tests)
+
+  def run_batch(self, tests, output_dir, logging_context='', benchmark_finished_callback=None):
+    if self.config.single_jvm:
+      # A JMH invocation runs all its benchmarks with the same forks and time, so tests with overrides are grouped
+      # separately.
+      tests_by_parameters = {}
+      for test in tests:
+        parameters = (self.config.parameter(test, 'forks'), self.config.parameter(test, 'time'))
+        tests_by_parameters.setdefault(parameters, []).append(test)
+      groups = [
+        parameter_tests[i::len(self.slots)]
+        for parameter_tests in tests_by_parameters.values() for i in range(len(self.slots))
+      ]
+      groups = [group for group in groups if group]
+      jobs = [
+        (
+          'group of {:d} benchmarks'.format(len(group)),
+          group,
+          lambda slot, index=index, group=group: self.run_benchmark_group(index, group, output_dir, slot)
+        )
+        for index, group in enumerate(groups)
+      ]
+    else:
+      jobs = [
+        (
+          '{}.{}'.format(test.class_name, test.method_name),
+          [test],
+          lambda slot, test=test: self.run_benchmark(test, output_dir, slot)
+        )
+        for test in tests
+      ]
+    started = 0
+
+    def logged_job(description, job_tests, job):
+      async def run(slot):
+        nonlocal started
+        if started > 0:
+          clear_console_line()
+        started += 1
+        print('{} [{} {:d}/{:d}] {}'.format(logging_context, self.config.name, started, len(jobs), description))
+        await job(slot)
+        if benchmark_finished_callback:
+          for test in job_tests:
+            benchmark_finished_callback(test)
+      return run
+
+    run_in_slots([logged_job(description, job_tests, job) for description, job_tests, job in jobs], self.slots)
+    if started > 0:
       clear_console_line()
 
-  def run_benchmark(self, test, output_dir):
-    benchmark_output_file = os.path.join(output_dir, self.config.benchmark_output_file(test))
-    benchmark_output_dir = os.path.dirname(benchmark_output_file)
-    os.makedirs(benchmark_output_dir)
-    time_ms = '{:d}ms'.format(self.config.time)
-    benchmark_command = [
-      'java', '-jar', self.config.jar,
-      '-f', str(self.config.forks),
+  def benchmark_command(self, regex, output_file, fail_on_error=True, forks=None, iteration_time=None, jvm_args=None):
+    time_ms = '{:d}ms'.format(iteration_time if iteration_time is not None else self.config.time)
+    # Configurations pickled before the JVM, threads and mode could be configured lack the attributes.
+    command = [
+      getattr(self.config, 'java', 'java'), '-jar', self.config.jar,
+      '-f', str(forks if forks is not None else self.config.forks),
       '-w', time_ms,
       '-r', time_ms,
-      '-foe', 'true',
+      '-foe', 'true' if fail_on_error else 'false',
       '-rf', 'json',
-      '-rff', benchmark_output_file,
-      self.benchmark_regex(test)
+      '-rff', output_file
     ]
-    subprocess.run(benchmark_command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    threads = getattr(self.config, 'threads', None)
+    if threads is not None:
+      command.extend(['-t', str(threads)])
+    mode = getattr(self.config, 'mode', None)
+    if mode is not None:
+      command.extend(['-bm', mode])
+    time_unit = getattr(self.config, 'time_unit', None)
+    if time_unit is not None:
+      command.extend(['-tu', time_unit])
+    for profiler in self.config.profilers:
+      command.extend(['-prof', profiler])
+    # Appended rather than replacing the options of @Fork annotations, which benchmarks may rely on.
+    jvm_args = getattr(self.config, 'jvm_args', []) + (jvm_args or [])
+    if any(re.search(r'\s', jvm_arg) for jvm_arg in jvm_args):
+      # JMH splits the -jvmArgsAppend value on whitespace, which would silently break such arguments up.
+      raise ValueError('JVM arguments cannot contain whitespace: {}'.format(jvm_args))
+    if jvm_args:
+      command.extend(['-jvmArgsAppend', ' '.join(jvm_args)])
+    command.append(regex)
+    return command
+
+  def benchmark_output_valid(self, test, output_dir):
+    execution_file = os.path.join(output_dir, self.config.benchmark_execution_file(test))
+    benchmark_output_file = os.path.join(output_dir, self.config.benchmark_output_file(test))
+    # The execution file is written last, after the benchmark process has exited.
+    if not os.path.exists(execution_file) or not os.path.exists(benchmark_output_file):
+      return False
+    try:
+      with open(execution_file, 'r') as f:
+        json.load(f)
+      if os.path.getsize(benchmark_output_file) > 0:
+        with open(benchmark_output_file, 'r') as f:
+          json.load(f)
+    except ValueError:
+      return False
+    return True
+
+  def clear_benchmark_output(self, test, output_dir):
+    benchmark_output_dir = os.path.dirname(os.path.join(output_dir, self.config.benchmark_output_file(test)))
+    if os.path.exists(benchmark_output_dir):
+      shutil.rmtree(benchmark_output_dir)
+
+  def prepare_benchmark_output(self, test, output_dir):
+    benchmark_output_file = os.path.join(output_dir, self.config.benchmark_output_file(test))
+    os.makedirs(os.path.dirname(benchmark_output_file))
+    return benchmark_output_file
+
+  def write_execution_data(self, test, output_dir, slot, process_result, started=None, finished=None):
+    if process_result.telemetry is not None:
+      with open(os.path.join(output_dir, self.config.benchmark_telemetry_file(test)), 'w') as f:
+        json.dump(process_result.telemetry.to_dict(), f, indent=4)
+    execution = slot.to_dict()
+    execution.update(process_result.to_dict())
+    # Wall clock times of the benchmark process, which allow the analysis of order effects.
+    execution['started'] = started
+    execution['finished'] = finished
+    with open(os.path.join(output_dir, self.config.benchmark_execution_file(test)), 'w') as f:
+      json.dump(execution, f, indent=4)
+
+  async def run_benchmark(self, test, output_dir, slot):
+    benchmark_output_file = self.prepare_benchmark_output(test, output_dir)
+    forks = self.config.parameter(test, 'forks')
+    iteration_time = self.config.parameter(test, 'time')
+    benchmark_command = self.benchmark_command(
+      self.benchmark_regex(test), benchmark_output_file, forks=forks, iteration_time=iteration_time
+    )
+    started = time.time()
+    process_result = await run_process(
+      slot.wrap_command(benchmark_command),
+      timeout=self.config.benchmark_time_budget(forks=forks, time=iteration_time),
+      log_file=os.path.join(output_dir, self.config.benchmark_log_file(test))
+    )
+    self.write_execution_data(test, output_dir, slot, process_result, started, time.time())
+
+  async def run_benchmark_group(self, index, tests, output_dir, slot):
+    benchmark_output_files = {test: self.prepare_benchmark_output(test, output_dir) for test in tests}
+    group_output_file = os.path.join(output_dir, self.config.group_output_file(index))
+    # Let JMH continue past failing benchmarks; their results are simply missing from the combined output.
+    # All tests of a group share their forks and time.
+    forks = self.config.parameter(tests[0], 'forks')
+    iteration_time = self.config.parameter(tests[0], 'time')
+    benchmark_command = self.benchmark_command(
+      self.batch_regex(tests), group_output_file, fail_on_error=False, forks=forks, iteration_time=iteration_time
+    )
+    started = time.time()
+    process_result = await run_process(
+      slot.wrap_command(benchmark_command),
+      timeout=self.config.benchmark_time_budget(len(tests), forks, iteration_time),
+      log_file=os.path.join(output_dir, self.config.group_log_file(index))
+    )
+    finished = time.time()
+    self.split_group_output(group_output_file, benchmark_output_files)
+    for test in tests:
+      self.write_execution_data(test, output_dir, slot, process_result, started, finished)
+
+  def split_group_output(self, group_output_file, benchmark_output_files):
+    group_output = []
+    if os.path.exists(group_output_file):
+      if os.path.getsize(group_output_file) > 0:
+        with open(group_output_file, 'r') as f:
+          group_output = json.load(f)
+      os.remove(group_output_file)
+    for test, benchmark_output_file in benchmark_output_files.items():
+      regex = re.compile(self.benchmark_regex(test))
+      benchmark_output = [benchmark for benchmark in group_output if regex.search(benchmark['benchmark'])]
+      with open(benchmark_output_file, 'w') as f:
+        # Leave the file empty for benchmarks without results, matching the output of a failed run.
+        if benchmark_output:
+          json.dump(benchmark_output, f, indent=4)
 
 
 class Ju2JmhBenchmarkRunner(JmhBenchmarkRunner):
@@ -122,6 +465,8 @@ class Ju4RunnerBenchmarkRunner(JmhBenchmarkRunner):
 class ExperimentRunner:
   @staticmethod
   def _create_runner(config):
+    if config.approach == 'gradle-test' and config.launcher == 'direct':
+      return DirectJUnitTestRunner(config)
     approaches = {
       'gradle-test': GradleTestRunner,
       'jmh': JmhBenchmarkRunner,
@@ -133,10 +478,15 @@ class ExperimentRunner:
   def __init__(self, config):
     self.config = config
     self.benchmark_runners = [ExperimentRunner._create_runner(rc) for rc in config.runner_configs]
+    self.runner_indices = {runner.name: i for i, runner in enumerate(self.benchmark_runners)}
     self.batch = 0
     self.repetition = 0
+    self.completed_runners = set()
+    self.completed_benchmarks = {}
+    self.estimator = ExperimentCostEstimator(config)
 
   def run_experiment(self):
+    self.config.save_test_batches()
     self.load_progress()
     while self.batch < len(self.config.test_batches):
       self.run_current_repetition()
@@ -144,35 +494,215 @@ class ExperimentRunner:
 
   def run_current_repetition(self):
     repetition_dir = self.config.repetition_dir(self.batch, self.repetition)
-    if os.path.exists(repetition_dir):
+    resuming = self.completed_runners or self.completed_benchmarks
+    schedule = self.repetition_schedule(resuming)
+    if not any(schedule.values()):
+      # All tests of the batch have converged or reached the repetitions they are overridden to.
+      self.finish_batch()
+      return
+    if os.path.exists(repetition_dir) and not resuming:
       shutil.rmtree(repetition_dir)
-    os.makedirs(repetition_dir)
-    for i in range(len(self.benchmark_runners)):
-      logging_context = '[Batch {:d}/{:d}, repetition {:d}/{:d}, runner {:d}/{:d}]'.format(
+    os.makedirs(repetition_dir, exist_ok=True)
+    if self.config.adaptive is not None:
+      self.save_repetition_schedule(schedule)
+    order = self.repetition_order(schedule, resuming)
+    units = [
+      (
+        self.runner_indices[unit['runner']],
+        [Test(class_name, method_name) for class_name, method_name in unit['tests']]
+      )
+      for unit in order['units']
+    ]
+    remaining_units = {}
+    for i, _ in units:
+      remaining_units[i] = remaining_units.get(i, 0) + 1
+    for position, (i, tests) in enumerate(units):
+      runner = self.benchmark_runners[i]
+      remaining_units[i] -= 1
+      if runner.name in self.completed_runners:
+        continue
+      batch_estimate = self.estimator.batch_estimate(self.batch, self.repetition, self.completed_runners)
+      logging_context = '[Batch {:d}/{:d}, repetition {:d}/{:d}, runner {:d}/{:d}, ETA {} / {}]'.format(
         self.batch + 1, len(self.config.test_batches),
         self.repetition + 1, self.config.repetitions,
-        i + 1, len(self.benchmark_runners)
+        i + 1, len(self.benchmark_runners),
+        format_duration(batch_estimate),
+        format_duration(batch_estimate + self.estimator.experiment_estimate(self.batch + 1))
       )
-      runner = self.benchmark_runners[i]
-      runner.run_batch(self.config.test_batches[self.batch], repetition_dir, logging_context=logging_context)
+      start = time.monotonic()
+      started = time.time()
+      if isinstance(runner, JmhBenchmarkRunner):
+        completed = self.completed_benchmarks.setdefault(runner.name, set())
+        remaining_tests = [
+          test for test in tests if test not in completed or not runner.benchmark_output_valid(test, repetition_dir)
+        ]
+        for test in remaining_tests:
+          completed.discard(test)
+          runner.clear_benchmark_output(test, repetition_dir)
+        runner.run_batch(
+          remaining_tests, repetition_dir, logging_context=logging_context,
+          benchmark_finished_callback=lambda test, runner=runner: self.benchmark_finished(runner, test)
+        )
+        executed_tests = remaining_tests
+      else:
+        runner.run_batch(tests, repetition_dir, logging_context=logging_context)
+        executed_tests = tests
+      if executed_tests:
+        self.estimator.record(self.batch, self.repetition, runner.config, executed_tests, time.monotonic() - start)
+        order['units'][position]['started'] = started
+        order['units'][position]['finished'] = time.time()
+        self.save_repetition_order(order)
+      if remaining_units[i] == 0:
+        self.completed_runners.add(runner.name)
+        self.completed_benchmarks.pop(runner.name, None)
+      self.save_progress()
+    self.completed_runners = set()
+    self.completed_benchmarks = {}
     self.repetition += 1
     if self.repetition >= self.config.repetitions:
-      self.batch += 1
-      self.repetition = 0
+      self.finish_batch()
+
+  def finish_batch(self):
+    if self.config.adaptive is not None:
+      self.save_repetition_counts()
+    self.batch += 1
+    self.repetition = 0
+
+  def repetition_schedule(self, resuming):
+    tests = self.config.test_batches[self.batch]
+    adaptive = self.config.adaptive
+    if adaptive is None or self.repetition < adaptive.min_repetitions:
+      schedule = {runner.name: tests for runner in self.benchmark_runners}
+    elif resuming:
+      return self.load_repetition_schedule(self.batch, self.repetition)
+    else:
+      # Schedules only shrink, so tests in the previous schedule have been run in every repetition so far.
+      previous_schedule = self.load_repetition_schedule(self.batch, self.repetition - 1)
+      schedule = {
+        runner.name: self.unconverged_tests(runner, previous_schedule[runner.name])
+        for runner in self.benchmark_runners
+      }
+    runner_configs = {runner.name: runner.config for runner in self.benchmark_runners}
+    return {
+      runner_name: [test for test in tests if runner_configs[runner_name].scheduled(test, self.repetition)]
+      for runner_name, tests in schedule.items()
+    }
+
+  def repetition_order(self, schedule, resuming):
+    # The order of (runner, tests) units of the repetition, with the time each unit was run once it has been.
+    order_file = self.config.repetition_order_file(self.batch, self.repetition)
+    if resuming and os.path.exists(order_file):
+      with open(order_file, 'r') as f:
+        return json.load(f)
+    scheduling = self.config.scheduling
+    units = scheduling.units(self.config.runner_configs, schedule, self.batch, self.repetition)
+    order = {
+      'order': scheduling.order,
+      'seed': scheduling.seed,
+      'repetition_seed': scheduling.repetition_seed(self.batch, self.repetition),
+      'units': [
+        {
+          'runner': self.benchmark_runners[i].name,
+          'tests': [[test.class_name, test.method_name] for test in tests]
+        }
+        for i, tests in units
+      ]
+    }
+    self.save_repetition_order(order)
+    return order
+
+  def save_repetition_order(self, order):
+    order_file = self.config.repetition_order_file(self.batch, self.repetition)
+    with open(order_file + '.new', 'w') as f:
+      json.dump(order, f, indent=4)
+    os.replace(order_file + '.new', order_file)
+
+  def unconverged_tests(self, runner, tests):
+    if not tests:
+      return []
+    collector = ExperimentDataCollector._create_collector(runner.config)
+    results = {test: [] for test in tests}
+    for repetition in range(self.repetition):
+      repetition_results = collector.collect_repetition_data(tests, self.config.repetition_dir(self.batch, repetition))
+      for test in tests:
+        results[test].append(repetition_results[test])
+    return [
+      test for test in tests
+      if not self.config.adaptive.converged(ThroughputStatistics(Result.merge(results[test])))
+    ]
+
+  def load_repetition_schedule(self, batch, repetition):
+    with open(self.config.repetition_schedule_file(batch, repetition), 'r') as f:
+      schedule = json.load(f)
+    return {
+      runner_name: [Test(class_name, method_name) for class_name, method_name in tests]
+      for runner_name, tests in schedule.items()
+    }
+
+  def save_repetition_schedule(self, schedule):
+    with open(self.config.repetition_schedule_file(self.batch, self.repetition), 'w') as f:
+      json.dump(
+        {
+          runner_name: [[test.class_name, test.method_name] for test in tests]
+          for runner_name, tests in schedule.items()
+        },
+        f, indent=4
+      )
+
+  def save_repetition_counts(self):
+    repetitions = {runner.name: {} for runner in self.benchmark_runners}
+    for repetition in range(self.config.repetitions):
+      if not os.path.exists(self.config.repetition_schedule_file(self.batch, repetition)):
+        break
+      schedule = self.load_repetition_schedule(self.batch, repetition)
+      for runner_name, tests in schedule.items():
+        for test in tests:
+          repetitions[runner_name][test] = repetitions[runner_name].get(test, 0) + 1
+    with open(self.config.repetition_counts_file(self.batch), 'w') as f:
+      json.dump(
+        {
+          runner_name: [
+            {'class': test.class_name, 'test': test.method_name, 'repetitions': count}
+            for test, count in sorted(counts.items())
+          ]
+          for runner_name, counts in repetitions.items()
+        },
+        f, indent=4
+      )
+
+  def benchmark_finished(self, runner, test):
+    self.completed_benchmarks.setdefault(runner.name, set()).add(test)
+    self.save_progress()
 
   def load_progress(self):
     if os.path.exists(self.config.progress_backup_file):
       if os.path.exists(self.config.progress_file):
         os.remove(self.config.progress_file)
-      os.rename(self.config.progress_backup_file, self.progress_file)
+      os.rename(self.config.progress_backup_file, self.config.progress_file)
     if os.path.exists(self.config.progress_file):
       with open(self.config.progress_file, 'r') as f:
         progress = json.load(f)
       self.batch = progress['batch']
       self.repetition = progress['repetition']
+      self.completed_runners = set(progress['completed_runners'] if 'completed_runners' in progress else [])
+      completed_benchmarks = progress['completed_benchmarks'] if 'completed_benchmarks' in progress else {}
+      self.completed_benchmarks = {
+        runner_name: {Test(class_name, method_name) for class_name, method_name in tests}
+        for runner_name, tests in completed_benchmarks.items()
+      }
+      self.estimator.timing_history = progress['timing'] if 'timing' in progress else []
 
   def save_progress(self):
-    progress = {'batch': self.batch, 'repetition': self.repetition}
+    progress = {
+      'batch': self.batch,
+      'repetition': self.repetition,
+      'completed_runners': sorted(self.completed_runners),
+      'completed_benchmarks': {
+        runner_name: [[test.class_name, test.method_name] for test in sorted(tests)]
+        for runner_name, tests in self.completed_benchmarks.items()
+      },
+      'timing': self.estimator.timing_history
+    }
     if os.path.exists(self.config.progress_file):
       os.rename(self.config.progress_file, self.config.progress_backup_file)
     with open(self.config.progress_file, 'w') as f:
@@ -181,3 +711,93 @@ class ExperimentRunner:
       os.fsync(f.fileno())
     if os.path.exists(self.config.progress_backup_file):
       os.remove(self.config.progress_backup_file)
+
+
+class ExperimentWorker:
+  poll_interval = 5
+
+  def __init__(self, config, worker_id=None, lease_timeout=600):
+    if config.adaptive is not None:
+      raise ValueError('Adaptive repetitions cannot be distributed over workers')
+    self.config = config
+    self.worker_id = worker_id if worker_id is not None else default_worker_id()
+    self.queue = WorkQueue(config.queue_dir, lease_timeout=lease_timeout)
+    self.benchmark_runners = [ExperimentRunner._create_runner(rc) for rc in config.runner_configs]
+
+  def run_experiment(self):
+    self.config.save_test_batches()
+    self.queue.initialize(self.config, self.worker_id)
+    while True:
+      item = self.queue.claim(self.worker_id)
+      if item is None:
+        if self.queue.finished():
+          break
+        # Remaining items are claimed by other workers, whose leases may still expire.
+        time.sleep(ExperimentWorker.poll_interval)
+        continue
+      self.run_item(item)
+
+  def run_item(self, item):
+    runner = self.benchmark_runners[item.runner_index]
+    logging_context = '[{}: batch {:d}/{:d}, repetition {:d}/{:d}, runner {:d}/{:d}]'.format(
+      self.worker_id,
+      item.batch + 1, len(self.config.test_batches),
+      item.repetition + 1, self.config.repetitions,
+      item.runner_index + 1, len(self.benchmark_runners)
+    )
+    staging_dir = self.queue.item_staging_dir(item, self.worker_id)
+    if os.path.exists(staging_dir):
+      shutil.rmtree(staging_dir)
+    os.makedirs(staging_dir)
+    started = time.time()
+    tests = [test for test in self.config.test_batches[item.batch] if runner.config.scheduled(test, item.repetition)]
+    with LeaseHeartbeat(self.queue, item, self.worker_id):
+      if tests:
+        runner.run_batch(tests, staging_dir, logging_context=logging_context)
+      worker_info = {
+        'worker': self.worker_id,
+        'host': socket.gethostname(),
+        'pid': os.getpid(),
+        'started': started,
+        'finished': time.time()
+      }
+      # If the lease expired, another worker may be running the item and its output must not be overwritten with
+      # this one's. The lease is kept while publishing, and the item is only completed once its output is published,
+      # so that a worker dying in between leaves it to be run and published again.
+      if not self.queue.holds_lease(item, self.worker_id):
+        shutil.rmtree(staging_dir)
+        print('{} Lease expired before completion, the item will be run again.'.format(logging_context))
+        return
+      self.publish_output(item, staging_dir, worker_info)
+      if not self.queue.complete(item, self.worker_id, worker_info):
+        print('{} Lease expired while publishing, the item will be run again.'.format(logging_context))
+
+  def publish_output(self, item, staging_dir, worker_info):
+    # Publishing is repeatable: outputs of an earlier run of the item that this run did not produce are removed,
+    # which relies on the list of the item's outputs being written before any of them is moved.
+    repetition_dir = self.config.repetition_dir(item.batch, item.repetition)
+    os.makedirs(repetition_dir, exist_ok=True)
+    runner_config = self.config.runner_configs[item.runner_index]
+    outputs_file = self.config.runner_outputs_file(item.batch, item.repetition, runner_config)
+    outputs = sorted(os.listdir(staging_dir))
+    if os.path.exists(outputs_file):
+      with open(outputs_file, 'r') as f:
+        previous_outputs = json.load(f)
+      for entry in set(previous_outputs) - set(outputs):
+        destination = os.path.join(repetition_dir, entry)
+        if os.path.isdir(destination):
+          shutil.rmtree(destination)
+        elif os.path.exists(destination):
+          os.remove(destination)
+    temporary_file = '{}@{}'.format(outputs_file, self.worker_id)
+    with open(temporary_file, 'w') as f:
+      json.dump(outputs, f, indent=4)
+    os.replace(temporary_file, outputs_file)
+    for entry in outputs:
+      destination = os.path.join(repetition_dir, entry)
+      if os.path.isdir(destination):
+        shutil.rmtree(destination)
+      os.replace(os.path.join(staging_dir, entry), destination)
+    os.rmdir(staging_dir)
+    with open(self.config.runner_worker_file(item.batch, item.repetition, runner_config), 'w') as f:
+      json.dump(worker_info, f, indent=4)
@@ -59,6 +59,8 @@ class TestComparisonResult:
     self.runner = runner
     self.alpha = alpha
     self.run_comparison_results = run_comparison_results
+    # Ranked HotMethodDifference list, set by profiling.profile_slowdowns for significant slowdowns.
+    self.hot_method_diff = None
 
   @cached_property
   def _test_results(self):
@@ -0,0 +1,126 @@
+import numpy
+
+
+class VarianceComponents:
+  def __init__(self, mean, measurements, forks, repetitions, iteration, fork, repetition):
+    self.mean = mean
+    self.measurements = measurements
+    self.forks = forks
+    self.repetitions = repetitions
+    # Variance between iterations of a fork, between forks of a repetition and between repetitions. Components that
+    # cannot be estimated, e.g. the fork component of results with a single fork per repetition, are None.
+    self.iteration = iteration
+    self.fork = fork
+    self.repetition = repetition
+
+  @property
+  def total(self):
+    return sum(component for component in (self.iteration, self.fork, self.repetition) if component is not None)
+
+  def fraction(self, component):
+    value = getattr(self, component)
+    if value is None or not self.total:
+      return None
+    return value / self.total
+
+
+def _optional(value):
+  return float(value) if numpy.isfinite(value) else None
+
+
+def decompose_variance(experiment_results):
+  # Method of moments estimates for the nested random-effects model repetition > fork > iteration, computed for all
+  # (batch, test, runner) units at once from per-group sums. The coefficients follow the unbalanced nested ANOVA, so
+  # forks with failed iterations and repetitions skipped by adaptive runs are handled.
+  units = {}
+  values = []
+  unit_ids = []
+  repetition_ids = []
+  fork_ids = []
+  repetition_keys = {}
+  fork_count = 0
+  for result in experiment_results.get_results(combine_repetitions=False):
+    if result.result.errors or not result.result.throughput:
+      continue
+    unit = units.setdefault((result.batch, result.test, result.runner), len(units))
+    repetition = repetition_keys.setdefault((unit, result.repetition), len(repetition_keys))
+    for fork in result.result.fork_throughput:
+      values.extend(fork)
+      unit_ids.extend([unit] * len(fork))
+      repetition_ids.extend([repetition] * len(fork))
+      fork_ids.extend([fork_count] * len(fork))
+      fork_count += 1
+  if not values:
+    return {}
+  x = numpy.array(values, dtype=numpy.float64)
+  unit_ids = numpy.array(unit_ids)
+  repetition_ids = numpy.array(repetition_ids)
+  fork_ids = numpy.array(fork_ids)
+  unit_count = len(units)
+
+  # Group membership of forks and repetitions.
+  fork_repetition = numpy.zeros(fork_count, dtype=numpy.int64)
+  fork_repetition[fork_ids] = repetition_ids
+  fork_unit = numpy.zeros(fork_count, dtype=numpy.int64)
+  fork_unit[fork_ids] = unit_ids
+  repetition_unit = numpy.zeros(len(repetition_keys), dtype=numpy.int64)
+  repetition_unit[repetition_ids] = unit_ids
+
+  def group_means(ids, count):
+    n = numpy.bincount(ids, minlength=count).astype(numpy.float64)
+    return n, numpy.bincount(ids, weights=x, minlength=count) / n
+
+  n_fork, mean_fork = group_means(fork_ids, fork_count)
+  n_repetition, mean_repetition = group_means(repetition_ids, len(repetition_keys))
+  n_unit, mean_unit = group_means(unit_ids, unit_count)
+
+  def unit_sum(ids, weights):
+    return numpy.bincount(ids, weights=weights, minlength=unit_count)
+
+  ss_iteration = unit_sum(unit_ids, (x - mean_fork[fork_ids]) ** 2)
+  ss_fork = unit_sum(fork_unit, n_fork * (mean_fork - mean_repetition[fork_repetition]) ** 2)
+  ss_repetition = unit_sum(repetition_unit, n_repetition * (mean_repetition - mean_unit[repetition_unit]) ** 2)
+  forks = unit_sum(fork_unit, numpy.ones(fork_count))
+  repetitions = unit_sum(repetition_unit, numpy.ones(len(repetition_keys)))
+  df_iteration = n_unit - forks
+  df_fork = forks - repetitions
+  df_repetition = repetitions - 1
+
+  squared_fork_sizes = numpy.bincount(fork_repetition, weights=n_fork ** 2, minlength=len(repetition_keys))
+  sum_squared_fork_sizes_by_repetition = unit_sum(repetition_unit, squared_fork_sizes / n_repetition)
+  sum_squared_fork_sizes = unit_sum(fork_unit, n_fork ** 2)
+  sum_squared_repetition_sizes = unit_sum(repetition_unit, n_repetition ** 2)
+
+  with numpy.errstate(divide='ignore', invalid='ignore'):
+    ms_iteration = ss_iteration / df_iteration
+    ms_fork = ss_fork / df_fork
+    ms_repetition = ss_repetition / df_repetition
+    fork_coefficient = (n_unit - sum_squared_fork_sizes_by_repetition) / df_fork
+    repetition_fork_coefficient = (
+      (sum_squared_fork_sizes_by_repetition - sum_squared_fork_sizes / n_unit) / df_repetition
+    )
+    repetition_coefficient = (n_unit - sum_squared_repetition_sizes / n_unit) / df_repetition
+    # With a single iteration per fork, e.g. Gradle executions, the fork component includes the iteration variance.
+    iteration_variance = numpy.where(df_iteration > 0, ms_iteration, numpy.nan)
+    within_fork_variance = numpy.nan_to_num(iteration_variance)
+    fork_variance = numpy.where(df_fork > 0, (ms_fork - within_fork_variance) / fork_coefficient, numpy.nan)
+    # Likewise, with a single fork per repetition the repetition component includes the fork variance.
+    repetition_variance = numpy.where(
+      df_repetition > 0,
+      (
+        ms_repetition - within_fork_variance
+        - repetition_fork_coefficient * numpy.nan_to_num(numpy.maximum(fork_variance, 0))
+      ) / repetition_coefficient,
+      numpy.nan
+    )
+  # Negative estimates of variance components are truncated to zero.
+  fork_variance = numpy.maximum(fork_variance, 0)
+  repetition_variance = numpy.maximum(repetition_variance, 0)
+
+  return {
+    key: VarianceComponents(
+      float(mean_unit[unit]), int(n_unit[unit]), int(forks[unit]), int(repetitions[unit]),
+      _optional(iteration_variance[unit]), _optional(fork_variance[unit]), _optional(repetition_variance[unit])
+    )
+    for key, unit in units.items()
+  }
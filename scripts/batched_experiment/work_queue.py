@@ -0,0 +1,183 @@
+import json
+import os
+import shutil
+import socket
+import threading
+import time
+
+
+class WorkItem:
+  def __init__(self, batch, repetition, runner_index, runner_name):
+    self.batch = batch
+    self.repetition = repetition
+    self.runner_index = runner_index
+    self.runner_name = runner_name
+
+  @property
+  def name(self):
+    # Zero-padded so that workers claim items in batch, repetition, runner order.
+    return 'b{:06d}-r{:04d}-c{:03d}.json'.format(self.batch, self.repetition, self.runner_index)
+
+  def to_dict(self):
+    return {
+      'batch': self.batch,
+      'repetition': self.repetition,
+      'runner_index': self.runner_index,
+      'runner': self.runner_name
+    }
+
+  @staticmethod
+  def from_dict(d):
+    return WorkItem(d['batch'], d['repetition'], d['runner_index'], d['runner'])
+
+
+def default_worker_id():
+  return '{}-{:d}'.format(socket.gethostname(), os.getpid())
+
+
+class WorkQueue:
+  def __init__(self, queue_dir, lease_timeout=600):
+    self.queue_dir = queue_dir
+    self.lease_timeout = lease_timeout
+    self.pending_dir = os.path.join(queue_dir, 'pending')
+    self.claimed_dir = os.path.join(queue_dir, 'claimed')
+    self.done_dir = os.path.join(queue_dir, 'done')
+    self.staging_dir = os.path.join(queue_dir, 'staging')
+    self.initialized_file = os.path.join(queue_dir, 'initialized')
+    self.initialization_lock = os.path.join(queue_dir, 'initialization.lock')
+
+  def initialize(self, config, worker_id):
+    os.makedirs(self.queue_dir, exist_ok=True)
+    try:
+      # mkdir is atomic, so normally exactly one worker expands the configuration into work items.
+      os.mkdir(self.initialization_lock)
+    except FileExistsError:
+      while not os.path.exists(self.initialized_file):
+        # The initializing worker keeps the lock fresh; if it died, the waiting workers take over, which is safe as
+        # the work items are published with a single rename that only one of them can make.
+        if self.lease_expired(self.initialization_lock):
+          break
+        time.sleep(1)
+      else:
+        return
+    for directory in (self.claimed_dir, self.done_dir, self.staging_dir):
+      os.makedirs(directory, exist_ok=True)
+    pending_dir = os.path.join(self.staging_dir, WorkQueue._claimed_name('pending', worker_id))
+    if os.path.exists(pending_dir):
+      shutil.rmtree(pending_dir)
+    os.makedirs(pending_dir)
+    for batch in range(len(config.test_batches)):
+      os.utime(self.initialization_lock)
+      for repetition in range(config.repetitions):
+        for runner_index in range(len(config.runner_configs)):
+          item = WorkItem(batch, repetition, runner_index, config.runner_configs[runner_index].name)
+          with open(os.path.join(pending_dir, item.name), 'w') as f:
+            json.dump(item.to_dict(), f)
+    try:
+      os.rename(pending_dir, self.pending_dir)
+    except OSError:
+      if not os.path.exists(self.pending_dir):
+        raise
+      # Published by another worker that took over as well.
+      shutil.rmtree(pending_dir)
+    with open(self.initialized_file, 'w') as f:
+      f.flush()
+      os.fsync(f.fileno())
+
+  @staticmethod
+  def _claimed_name(item_name, worker_id):
+    return '{}@{}'.format(item_name, worker_id)
+
+  def _claimed_file(self, item, worker_id):
+    return os.path.join(self.claimed_dir, WorkQueue._claimed_name(item.name, worker_id))
+
+  def claim(self, worker_id):
+    self.requeue_expired()
+    for item_name in sorted(os.listdir(self.pending_dir)):
+      claimed_file = os.path.join(self.claimed_dir, WorkQueue._claimed_name(item_name, worker_id))
+      try:
+        os.rename(os.path.join(self.pending_dir, item_name), claimed_file)
+      except FileNotFoundError:
+        # Claimed by another worker in the meantime.
+        continue
+      os.utime(claimed_file)
+      with open(claimed_file, 'r') as f:
+        return WorkItem.from_dict(json.load(f))
+    return None
+
+  def renew(self, item, worker_id):
+    os.utime(self._claimed_file(item, worker_id))
+
+  def holds_lease(self, item, worker_id):
+    return os.path.exists(self._claimed_file(item, worker_id))
+
+  def lease_expired(self, claimed_file):
+    # rename updates ctime, so a freshly claimed item is not mistaken for an expired one before it is touched.
+    stat = os.stat(claimed_file)
+    return time.time() - max(stat.st_mtime, stat.st_ctime) > self.lease_timeout
+
+  def requeue_expired(self):
+    for claimed_name in os.listdir(self.claimed_dir):
+      claimed_file = os.path.join(self.claimed_dir, claimed_name)
+      try:
+        if not self.lease_expired(claimed_file):
+          continue
+        item_name = claimed_name.split('@', 1)[0]
+        os.rename(claimed_file, os.path.join(self.pending_dir, item_name))
+      except FileNotFoundError:
+        # Completed or requeued by another worker.
+        continue
+
+  def complete(self, item, worker_id, worker_info):
+    done_file = os.path.join(self.done_dir, item.name)
+    try:
+      os.rename(self._claimed_file(item, worker_id), done_file)
+    except FileNotFoundError:
+      # The lease expired and the item was requeued.
+      return False
+    done = dict(item.to_dict())
+    done.update(worker_info)
+    temporary_file = os.path.join(self.staging_dir, WorkQueue._claimed_name(item.name, worker_id) + '.done')
+    with open(temporary_file, 'w') as f:
+      json.dump(done, f)
+      f.flush()
+      os.fsync(f.fileno())
+    os.replace(temporary_file, done_file)
+    return True
+
+  def finished(self):
+    return not os.listdir(self.pending_dir) and not os.listdir(self.claimed_dir)
+
+  def done_items(self):
+    items = []
+    for item_name in sorted(os.listdir(self.done_dir)):
+      with open(os.path.join(self.done_dir, item_name), 'r') as f:
+        items.append(WorkItem.from_dict(json.load(f)))
+    return items
+
+  def item_staging_dir(self, item, worker_id):
+    return os.path.join(self.staging_dir, WorkQueue._claimed_name(item.name, worker_id))
+
+
+class LeaseHeartbeat:
+  def __init__(self, work_queue, item, worker_id):
+    self.work_queue = work_queue
+    self.item = item
+    self.worker_id = worker_id
+    self._stopped = threading.Event()
+    self._thread = threading.Thread(target=self._run, daemon=True)
+
+  def _run(self):
+    while not self._stopped.wait(self.work_queue.lease_timeout / 4):
+      try:
+        self.work_queue.renew(self.item, self.worker_id)
+      except FileNotFoundError:
+        return
+
+  def __enter__(self):
+    self._thread.start()
+    return self
+
+  def __exit__(self, *exc_info):
+    self._stopped.set()
+    self._thread.join()
@@ -0,0 +1,84 @@
+import argparse
+import json
+import os
+import time
+
+
+from batched_experiment.jmh_output import extract_benchmark_output, parse_benchmark_output
+
+
+def find_output_files(paths):
+  files = []
+  for path in paths:
+    if os.path.isdir(path):
+      for directory, _, file_names in os.walk(path):
+        files.extend(os.path.join(directory, file_name) for file_name in file_names if file_name == 'output.json')
+    else:
+      files.append(path)
+  return sorted(files)
+
+
+def main():
+  parser = argparse.ArgumentParser(
+    description='Compare the reading of existing JMH output files by the data collector with json.load. Output with '
+                'secondary metrics is taken to come from runners with profilers, for which the collector parses the '
+                'whole file, and the primary metric is extracted from the rest.'
+  )
+  parser.add_argument('paths', type=str, nargs='+', help='JMH JSON result files or experiment output directories')
+  parser.add_argument('--repeat', type=int, default=5)
+  args = parser.parse_args()
+
+  texts = []
+  for path in find_output_files(args.paths):
+    if os.path.getsize(path) == 0:
+      continue
+    with open(path, 'r') as f:
+      texts.append(f.read())
+  if not texts:
+    print('No JMH output files found')
+    return
+  total_bytes = sum(len(text) for text in texts)
+
+  # Whether the collector needs the secondary metrics of each file, as it does for runners with profilers.
+  secondary_metrics = [bool(json.loads(text)[0].get('secondaryMetrics')) for text in texts]
+  primary_texts = [text for text, needed in zip(texts, secondary_metrics) if not needed]
+  fallbacks = 0
+  for text in primary_texts:
+    extracted = extract_benchmark_output(text)
+    if extracted is None:
+      fallbacks += 1
+      continue
+    expected = json.loads(text)[0]
+    for key in ('mode', 'primaryMetric'):
+      if extracted.get(key) != expected.get(key):
+        raise AssertionError('Extracted {} differs from json.load'.format(key))
+
+  def best_time(parse, texts):
+    times = []
+    for _ in range(args.repeat):
+      start = time.perf_counter()
+      for text in texts:
+        parse(text)
+      times.append(time.perf_counter() - start)
+    return min(times)
+
+  json_time = best_time(lambda text: json.loads(text)[0], texts)
+  collector_time = best_time(lambda item: parse_benchmark_output(*item), list(zip(texts, secondary_metrics)))
+  # File reads are excluded from all timings, as they cost the same for either parser.
+  print('{:d} files, {:.1f} MB, {:d} with secondary metrics, parsed in full'.format(
+    len(texts), total_bytes / 1e6, len(texts) - len(primary_texts)
+  ))
+  print('json.load:  {:.3f}s ({:.1f} MB/s)'.format(json_time, total_bytes / 1e6 / json_time))
+  print('collector:  {:.3f}s ({:.1f} MB/s)'.format(collector_time, total_bytes / 1e6 / collector_time))
+  print('speedup: {:.2f}x'.format(json_time / collector_time))
+  if primary_texts:
+    # The files the collector skims, of which those without the expected layout fall back to json.load.
+    primary_bytes = sum(len(text) for text in primary_texts)
+    primary_json_time = best_time(lambda text: json.loads(text)[0], primary_texts)
+    extraction_time = best_time(extract_benchmark_output, primary_texts)
+    print('without secondary metrics: {:d} files, {:.1f} MB, {:d} fall back to json.load, speedup {:.2f}x'.format(
+      len(primary_texts), primary_bytes / 1e6, fallbacks, primary_json_time / extraction_time
+    ))
+
+if __name__ == '__main__':
+  main()
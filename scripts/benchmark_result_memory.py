@@ -0,0 +1,120 @@
+import argparse
+import gc
+import pickle
+import random
+import tracemalloc
+from functools import total_ordering
+
+
+from batched_experiment.config import JMH_DEFAULT_MEASUREMENT_ITERATIONS, RunnerConfiguration, Test
+from batched_experiment.experiment_data import ExperimentResult, ExperimentResults, Result
+
+
+# The representation results had before Test, Result and ExperimentResult used slots, tests were interned and
+# throughput was kept in an array, as the baseline to compare with.
+@total_ordering
+class DictTest:
+  def __init__(self, class_name, method_name):
+    self.class_name = class_name
+    self.method_name = method_name
+
+  def __eq__(self, other):
+    return (self.class_name, self.method_name) == (other.class_name, other.method_name)
+
+  def __lt__(self, other):
+    return (self.class_name, self.method_name) < (other.class_name, other.method_name)
+
+  def __hash__(self):
+    return hash((self.class_name, self.method_name))
+
+
+class DictResult:
+  def __init__(self, throughput, fork_lengths, execution):
+    self.throughput = list(throughput)
+    self.fork_lengths = fork_lengths
+    self.errors = []
+    self.execution = execution
+    self.telemetry = None
+    self.metrics = {}
+    self.metric_units = {}
+    self.latency = None
+
+
+class DictExperimentResult:
+  def __init__(self, batch, repetition, test, runner, result):
+    self.batch = batch
+    self.repetition = repetition
+    self.test = test
+    self.runner = runner
+    self.result = result
+
+
+def synthetic_results(
+  results, runners, repetitions, forks, seed, test_type=Test, result_type=Result,
+  experiment_result_type=ExperimentResult
+):
+  rng = random.Random(seed)
+  runner_configs = [RunnerConfiguration('runner{:d}'.format(i), 'jmh') for i in range(runners)]
+  tests = results // (runners * repetitions)
+  experiment_results = []
+  for t in range(tests):
+    for runner_config in runner_configs:
+      for repetition in range(repetitions):
+        # Like the data collectors, which create a test for every output file they read.
+        test = test_type('org.example.Benchmark{:d}'.format(t // 10), 'test{:d}'.format(t % 10))
+        throughput = [rng.lognormvariate(10, 0.1) for _ in range(forks * JMH_DEFAULT_MEASUREMENT_ITERATIONS)]
+        result = result_type(
+          throughput=throughput, fork_lengths=[JMH_DEFAULT_MEASUREMENT_ITERATIONS] * forks,
+          execution={'worker': 0, 'started': 0.0, 'finished': 1.0}
+        )
+        experiment_results.append(experiment_result_type(t // 100, repetition, test, runner_config, result))
+  return experiment_results
+
+
+def measure(create_results):
+  # Memory taken by the results as collected and once unpickled, in bytes, and the size of their pickle.
+  gc.collect()
+  tracemalloc.start()
+  experiment_results = ExperimentResults.from_results(None, create_results())
+  gc.collect()
+  collected_memory = tracemalloc.get_traced_memory()[0]
+  data = pickle.dumps(experiment_results)
+  del experiment_results
+  gc.collect()
+  baseline = tracemalloc.get_traced_memory()[0]
+  experiment_results = pickle.loads(data)
+  gc.collect()
+  loaded_memory = tracemalloc.get_traced_memory()[0] - baseline
+  tracemalloc.stop()
+  return collected_memory, loaded_memory, len(data)
+
+
+def main():
+  parser = argparse.ArgumentParser(
+    description='Compare the memory taken by the results of a synthetic experiment, as collected and when unpickled, '
+                'with that of the representation results had before slots and arrays were used.'
+  )
+  parser.add_argument('--results', type=int, default=100000)
+  parser.add_argument('--runners', type=int, default=2)
+  parser.add_argument('--repetitions', type=int, default=5)
+  parser.add_argument('--forks', type=int, default=2)
+  parser.add_argument('--seed', type=int, default=0)
+  args = parser.parse_args()
+
+  parameters = (args.results, args.runners, args.repetitions, args.forks, args.seed)
+  results = args.results // (args.runners * args.repetitions) * args.runners * args.repetitions
+  baseline = measure(lambda: synthetic_results(*parameters, DictTest, DictResult, DictExperimentResult))
+  compact = measure(lambda: synthetic_results(*parameters))
+
+  print('{:d} results with {:d} measurements each'.format(results, args.forks * JMH_DEFAULT_MEASUREMENT_ITERATIONS))
+  print('{:10s} {:>28s} {:>27s}'.format('', 'dictionaries and lists', 'slots and arrays'))
+  for label, baseline_memory, compact_memory in zip(('collected', 'unpickled'), baseline, compact):
+    print('{:10s} {:>8.1f} MB ({:5.0f} B/result) {:>8.1f} MB ({:5.0f} B/result) {:4.0%} less'.format(
+      label, baseline_memory / 1e6, baseline_memory / results, compact_memory / 1e6, compact_memory / results,
+      1 - compact_memory / baseline_memory
+    ))
+  print('{:10s} {:>8.1f} MB {:>25.1f} MB'.format('pickle', baseline[2] / 1e6, compact[2] / 1e6))
+
+
+if __name__ == '__main__':
+  main()
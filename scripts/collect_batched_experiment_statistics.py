@@ -1,24 +1,44 @@
 import argparse
 import csv
 import os
-import pickle
 
 
-from batched_experiment.experiment_statistics import ThroughputStatistics
+from batched_experiment.columnar import load_experiment_results
+from batched_experiment.config import MATRIX_AXES, JmhRunnerConfiguration
+from batched_experiment.experiment_data import Telemetry
+from batched_experiment.experiment_statistics import LATENCY_PERCENTILES, ThroughputStatistics
 
 
 def clear_console_line():
   print('\033[F\033[K', end='')
 
 
-def row_dict(result, statistics):
+def percentile_column(fraction):
+  # e.g. p50, p99 and p99_9
+  return 'p{:g}'.format(fraction * 100).replace('.', '_')
+
+
+latency_columns = ['latency_unit'] + [percentile_column(fraction) for fraction in LATENCY_PERCENTILES]
+
+
+variance_component_columns = [
+  'iteration_variance',
+  'fork_variance',
+  'repetition_variance',
+  'iteration_variance_fraction',
+  'fork_variance_fraction',
+  'repetition_variance_fraction'
+]
+
+
+def row_dict(result, statistics, variance_components=None):
   row = {
     'class': result.test.class_name,
     'test': result.test.method_name,
     'config_name': result.runner.name,
     'approach': result.runner.approach,
     'batch': result.batch,
-    'error': ','.join(sorted(set(statistics.result.errors))),
+    'error': ','.join(sorted(set(result.result.errors))),
     'measurements': statistics.measurements,
     'mean': statistics.mean,
     'variance': statistics.variance,
@@ -29,6 +49,26 @@ def row_dict(result, statistics):
   }
   if result.repetition is not None:
     row['repetition'] = result.repetition
+    # Position in the run order of the repetition and start time, for the analysis of order effects.
+    execution = result.result.execution or {}
+    row['order'] = execution.get('order')
+    row['started'] = execution.get('started')
+  # Matrix axes allow grouping and comparing runners, e.g. by GC algorithm or thread count.
+  is_jmh = isinstance(result.runner, JmhRunnerConfiguration)
+  row['matrix_name'] = getattr(result.runner, 'matrix_name', None) if is_jmh else None
+  for axis in MATRIX_AXES:
+    row[axis] = result.runner.axis_label(axis) if is_jmh else None
+  row['latency_unit'] = statistics.latency_unit
+  for fraction in LATENCY_PERCENTILES:
+    row[percentile_column(fraction)] = statistics.latency_percentiles.get(fraction)
+  telemetry = result.result.telemetry
+  for field in Telemetry.fields:
+    row[field] = getattr(telemetry, field) if telemetry is not None else None
+  if variance_components is not None:
+    components = variance_components.get((result.batch, result.test, result.runner))
+    for component in ('iteration', 'fork', 'repetition'):
+      row['{}_variance'.format(component)] = getattr(components, component) if components else None
+      row['{}_variance_fraction'.format(component)] = components.fraction(component) if components else None
   return row
 
 
@@ -38,19 +78,21 @@ def main():
   parser.add_argument('output_file', type=str)
   parser.add_argument('--combine-repetitions', dest='combine_reps',
                       action='store_true')
-  parser.set_defaults(combine_reps=False)
+  parser.add_argument('--variance-components', dest='variance_components', action='store_true')
+  parser.set_defaults(combine_reps=False, variance_components=False)
   args = parser.parse_args()
 
-  with open(args.data_file, 'rb') as f:
-    data = pickle.load(f)
+  data = load_experiment_results(args.data_file)
 
   field_names = [
     'class',
     'test',
     'config_name',
     'approach',
+    'matrix_name'
+  ] + list(MATRIX_AXES) + [
     'batch'
-  ] + (['repetition'] if not args.combine_reps else []) + [
+  ] + (['repetition', 'order', 'started'] if not args.combine_reps else []) + [
     'error',
     'measurements',
     'mean',
@@ -59,7 +101,14 @@ def main():
     'standard_error',
     'cv',
     'cv_est'
-  ]
+  ] + latency_columns + list(Telemetry.fields) + (variance_component_columns if args.variance_components else [])
+
+  variance_components = None
+  if args.variance_components:
+    from batched_experiment.variance_decomposition import decompose_variance
+    print('decomposing variance')
+    variance_components = decompose_variance(data)
+    clear_console_line()
   
   with open(args.output_file, 'w') as f:
     csv_writer = csv.DictWriter(f, field_names, dialect=csv.unix_dialect)
@@ -69,7 +118,7 @@ def main():
     rows = []
     print('processing batch {:d}/{:d}'.format(batch + 1, len(data.config.test_batches)))
     for result in data.get_results(batch=batch, combine_repetitions=args.combine_reps):
-      rows.append(row_dict(result, ThroughputStatistics(result.result)))
+      rows.append(row_dict(result, ThroughputStatistics(result.result), variance_components))
     with open(args.output_file, 'a') as f:
       csv_writer = csv.DictWriter(f, field_names, dialect=csv.unix_dialect)
       csv_writer.writerows(rows)
@@ -0,0 +1,88 @@
+import argparse
+import csv
+import pickle
+
+
+from batched_experiment.config import MATRIX_AXES, JmhRunnerConfiguration
+
+
+def main():
+  parser = argparse.ArgumentParser(
+    description='Compare the throughput of runners that differ in a single matrix axis, e.g. GC or thread count.'
+  )
+  parser.add_argument('statistics_file', type=str)
+  parser.add_argument('output_file', type=str)
+  parser.add_argument('axis', type=str, choices=MATRIX_AXES)
+  parser.add_argument('--baseline', type=str, default=None,
+                      help='axis label the other values are compared to, the first in configuration order if not given')
+  args = parser.parse_args()
+
+  with open(args.statistics_file, 'rb') as f:
+    statistics = pickle.load(f)
+
+  runner_order = {runner_config: i for i, runner_config in enumerate(statistics.config.runner_configs)}
+  other_axes = [axis for axis in MATRIX_AXES if axis != args.axis]
+  # Results of the same test and matrix (or approach, for runners listed by hand) that agree on all other axes.
+  groups = {}
+  for result, result_statistics in statistics.get_results(combine_repetitions=True):
+    runner = result.runner
+    if not isinstance(runner, JmhRunnerConfiguration):
+      continue
+    family = getattr(runner, 'matrix_name', None) or runner.approach
+    key = (result.test, family, tuple(runner.axis_label(axis) for axis in other_axes))
+    groups.setdefault(key, []).append((result, result_statistics))
+
+  rows = []
+  def group_order(item):
+    test, family, labels = item[0]
+    return test, family, str(labels)
+
+  for (test, family, labels), members in sorted(groups.items(), key=group_order):
+    members.sort(key=lambda member: runner_order.get(member[0].runner, len(runner_order)))
+    if len(members) < 2:
+      continue
+    baseline = None
+    for result, result_statistics in members:
+      if args.baseline is None or result.runner.axis_label(args.axis) == args.baseline:
+        baseline = (result, result_statistics)
+        break
+    if baseline is None:
+      continue
+    baseline_mean = baseline[1].mean
+    for result, result_statistics in members:
+      row = {
+        'class': test.class_name,
+        'test': test.method_name,
+        'matrix': family,
+        'config_name': result.runner.name,
+        args.axis: result.runner.axis_label(args.axis),
+        'baseline': baseline[0].runner.axis_label(args.axis),
+        'error': ','.join(sorted(set(result.result.errors))),
+        'measurements': result_statistics.measurements,
+        'mean': result_statistics.mean,
+        'standard_error': result_statistics.stderr,
+        'relative_throughput': (
+          result_statistics.mean / baseline_mean if baseline_mean and result_statistics.mean is not None else None
+        )
+      }
+      row.update(zip(other_axes, labels))
+      rows.append(row)
+
+  field_names = ['class', 'test', 'matrix'] + other_axes + [
+    args.axis,
+    'config_name',
+    'baseline',
+    'error',
+    'measurements',
+    'mean',
+    'standard_error',
+    'relative_throughput'
+  ]
+  with open(args.output_file, 'w') as f:
+    csv_writer = csv.DictWriter(f, field_names, dialect=csv.unix_dialect)
+    csv_writer.writeheader()
+    csv_writer.writerows(rows)
+
+
+if __name__ == '__main__':
+  main()
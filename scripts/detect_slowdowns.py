@@ -4,6 +4,7 @@ import pickle
 
 
 from batched_experiment.config import Test
+from batched_experiment.profiling import JfrProfiler, profile_slowdowns
 from batched_experiment.slowdown_comparison import TwoTestComparison, SelfComparison, perform_comparisons
 
 
@@ -13,6 +14,9 @@ def main():
   parser.add_argument('test_comparisons', type=str)
   parser.add_argument('alpha', type=float)
   parser.add_argument('output_file', type=str)
+  parser.add_argument('--jfr-dir', type=str, default=None,
+                      help='re-run significant slowdowns with Java Flight Recorder and store the recordings here')
+  parser.add_argument('--jfr-top', type=int, default=20, help='number of hot methods to keep per slowdown')
   args = parser.parse_args()
 
   with open(args.statistics_file, 'rb') as f:
@@ -32,6 +36,11 @@ def main():
     test_comparisons = [parse_comparison(d) for d in json.load(f)]
 
   results = perform_comparisons(statistics, test_comparisons, args.alpha)
+
+  if args.jfr_dir is not None:
+    def progress_callback(current=0, total=0):
+      print('profiling slowdown {:d}/{:d}'.format(current + 1, total))
+    profile_slowdowns(results, JfrProfiler(args.jfr_dir), top=args.jfr_top, progress_callback=progress_callback)
   
   with open(args.output_file, 'wb') as f:
     pickle.dump(results, f)
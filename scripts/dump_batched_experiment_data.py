@@ -1,8 +1,13 @@
 import argparse
 import batched_experiment.data_collector
+import json
+import os
 import pickle
 
 
+from batched_experiment.columnar import load_experiment_results, write_columnar_results
+
+
 def clear_console_line():
   print('\033[F\033[K', end='')
 
@@ -11,6 +16,16 @@ def main():
   parser = argparse.ArgumentParser()
   parser.add_argument('config', type=str)
   parser.add_argument('output_file', type=str)
+  parser.add_argument('--include-partial', dest='include_partial', action='store_true')
+  parser.add_argument('--workers', type=int, default=1,
+                      help='number of processes reading the output in parallel, 0 for one per core')
+  parser.add_argument('--incremental', action='store_true',
+                      help='only read output that is new or changed since the output file was last written')
+  parser.add_argument('--manifest', type=str, default=None,
+                      help='manifest of the units in the output file, <output_file>.manifest.json by default')
+  parser.add_argument('--format', type=str, choices=('pickle', 'columnar'), default='pickle',
+                      help='columnar files are memory-mapped when read, so analyses do not load all data up front')
+  parser.set_defaults(include_partial=False)
   args = parser.parse_args()
 
   config = batched_experiment.config.BatchedExperimentConfiguration.parse_from_file(args.config)
@@ -25,11 +40,39 @@ def main():
       current_batch + 1, total_batches, current_repetition + 1, total_repetitions
     ))
 
-  experiment_results = data_collector.collect_experiment_data(progress_callback)
+  workers = args.workers if args.workers > 0 else None
+  manifest_file = args.manifest if args.manifest is not None else '{}.manifest.json'.format(args.output_file)
+  if args.incremental:
+    previous_results = None
+    manifest = None
+    if os.path.exists(args.output_file) and os.path.exists(manifest_file):
+      previous_results = load_experiment_results(args.output_file)
+      with open(manifest_file, 'r') as f:
+        manifest = json.load(f)
+    experiment_results, manifest = data_collector.collect_experiment_data_incrementally(
+      previous_results, manifest, progress_callback, include_partial=args.include_partial, workers=workers
+    )
+  else:
+    experiment_results = data_collector.collect_experiment_data(
+      progress_callback, include_partial=args.include_partial, workers=workers
+    )
+    manifest = None
   clear_console_line()
 
-  with open(args.output_file, 'wb') as f:
-    pickle.dump(experiment_results, f)
+  # The data is replaced before the manifest, so that an interruption at worst causes units to be read again.
+  if args.format == 'columnar':
+    write_columnar_results(experiment_results, args.output_file + '.new')
+  else:
+    with open(args.output_file + '.new', 'wb') as f:
+      pickle.dump(experiment_results, f)
+  os.replace(args.output_file + '.new', args.output_file)
+  if manifest is not None:
+    with open(manifest_file + '.new', 'w') as f:
+      json.dump(manifest, f)
+    os.replace(manifest_file + '.new', manifest_file)
+  elif os.path.exists(manifest_file):
+    # A full collection does not record the units it read, so a later incremental run starts from scratch.
+    os.remove(manifest_file)
 
 
 if __name__ == '__main__':
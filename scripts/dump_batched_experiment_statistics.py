@@ -3,6 +3,7 @@ import pickle
 import time
 
 
+from batched_experiment.columnar import load_experiment_results
 from batched_experiment.experiment_statistics import ExperimentStatistics
 
 
@@ -10,10 +11,14 @@ def main():
   parser = argparse.ArgumentParser()
   parser.add_argument('data_file', type=str)
   parser.add_argument('output_file', type=str)
+  parser.add_argument('--trim-warmup', dest='trim_warmup', action='store_true',
+                      help='drop the iterations of each fork before its detected steady state')
+  parser.add_argument('--variance-components', dest='variance_components', action='store_true',
+                      help='decompose the variance of each test into iteration, fork and repetition components')
+  parser.set_defaults(trim_warmup=False, variance_components=False)
   args = parser.parse_args()
 
-  with open(args.data_file, 'rb') as f:
-    data = pickle.load(f)
+  data = load_experiment_results(args.data_file)
 
   latest_update = None
   def progress_callback(current_separate=None, total_separate=None, current_combined=None, total_combined=None):
@@ -28,7 +33,17 @@ def main():
         progress.append('combined {:d}/{:d}'.format(current_combined + 1, total_combined))
       print('processing {}'.format(', '.join(progress)))
 
-  statistics = ExperimentStatistics.from_experiment_results(data, progress_callback=progress_callback)
+  variance_components = None
+  if args.variance_components:
+    # Imported here so that numpy is only required when the decomposition is requested.
+    from batched_experiment.variance_decomposition import decompose_variance
+    print('decomposing variance')
+    variance_components = decompose_variance(data)
+
+  statistics = ExperimentStatistics.from_experiment_results(
+    data, progress_callback=progress_callback, trim_warmup=args.trim_warmup,
+    variance_components=variance_components
+  )
 
   with open(args.output_file, 'wb') as f:
     pickle.dump(statistics, f)
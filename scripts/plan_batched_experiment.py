@@ -0,0 +1,95 @@
+import argparse
+import json
+import pickle
+
+
+from batched_experiment.estimate import DEFAULT_JVM_STARTUP, format_duration, measure_command_time
+from batched_experiment.planner import MeasurementPlanner
+from batched_experiment.variance_decomposition import decompose_variance
+
+
+def main():
+  parser = argparse.ArgumentParser(
+    description='Recommend forks, iteration time and repetitions per test from the statistics of a previous experiment.'
+  )
+  parser.add_argument('statistics_file', type=str)
+  parser.add_argument('base_config', type=str, help='configuration of the experiment to plan')
+  parser.add_argument('output_config', type=str)
+  parser.add_argument('output_test_list', type=str)
+  parser.add_argument('--target-width', type=float, required=True,
+                      help='target width of the confidence interval of the mean, relative to the mean')
+  parser.add_argument('--confidence', type=float, default=0.95)
+  parser.add_argument('--budget', type=float, default=None, help='total machine time budget in hours')
+  parser.add_argument('--jvm-startup', type=float, default=None,
+                      help='JVM startup overhead in seconds, measured with java -version if not given')
+  parser.add_argument('--max-repetitions', type=int, default=None)
+  parser.add_argument('--output-dir', type=str, default=None, help='output directory of the planned experiment')
+  args = parser.parse_args()
+
+  with open(args.statistics_file, 'rb') as f:
+    statistics = pickle.load(f)
+
+  jvm_startup = args.jvm_startup
+  if jvm_startup is None:
+    jvm_startup = measure_command_time(['java', '-version'])
+    if jvm_startup is None:
+      jvm_startup = DEFAULT_JVM_STARTUP
+
+  variance_components = {
+    (result.batch, result.test, result.runner):
+      statistics.get_variance_components(result.batch, result.test, result.runner)
+    for result, _ in statistics.get_results(combine_repetitions=True)
+  }
+  if None in variance_components.values():
+    print('decomposing variance')
+    variance_components = decompose_variance(statistics.results)
+
+  planner_options = {}
+  if args.max_repetitions is not None:
+    planner_options['max_repetitions'] = args.max_repetitions
+  planner = MeasurementPlanner(variance_components, jvm_startup, confidence=args.confidence, **planner_options)
+  budget = args.budget * 3600 if args.budget is not None else None
+  plans, target_width = planner.plan_within_budget(args.target_width, budget)
+
+  with open(args.base_config, 'r') as f:
+    config_dict = json.load(f)
+  with open(config_dict['test_list'], 'r') as f:
+    test_dicts = json.load(f)
+
+  overrides = {}
+  for plan in plans.values():
+    overrides.setdefault((plan.test.class_name, plan.test.method_name), {})[plan.runner.name] = plan.overrides()
+  for test_dict in test_dicts:
+    test_overrides = (
+      {runner: dict(runner_overrides) for runner, runner_overrides in test_dict['overrides'].items()}
+      if 'overrides' in test_dict else {}
+    )
+    # Planned parameters are merged into the existing overrides, which keeps e.g. skip and timeout.
+    for runner, runner_overrides in overrides.get((test_dict['class'], test_dict['test']), {}).items():
+      test_overrides.setdefault(runner, {}).update(runner_overrides)
+    if test_overrides:
+      test_dict['overrides'] = test_overrides
+  with open(args.output_test_list, 'w') as f:
+    json.dump(test_dicts, f, indent=4)
+
+  config_dict['test_list'] = args.output_test_list
+  if plans:
+    config_dict['repetitions'] = max(plan.repetitions for plan in plans.values())
+  if args.output_dir is not None:
+    config_dict['output_dir'] = args.output_dir
+  with open(args.output_config, 'w') as f:
+    json.dump(config_dict, f, indent=4)
+
+  print('JVM startup: {:.2f}s'.format(jvm_startup))
+  if target_width != args.target_width:
+    print('Target width relaxed from {:.4f} to {:.4f} to fit the budget'.format(args.target_width, target_width))
+  print('{:d}/{:d} test results reach the target width, {:d} repetitions, estimated machine time {}'.format(
+    sum(1 for plan in plans.values() if plan.target_reached), len(plans), config_dict['repetitions'],
+    format_duration(sum(plan.cost for plan in plans.values()))
+  ))
+  if budget is not None and sum(plan.cost for plan in plans.values()) > budget:
+    print('The budget of {:.2f} hours cannot be met'.format(args.budget))
+
+
+if __name__ == '__main__':
+  main()
@@ -1,16 +1,54 @@
 import argparse
+import json
+import os
 import batched_experiment.runner
 import batched_experiment.config
+import batched_experiment.estimate
+
+
+def print_estimate(config):
+  jvm_startup, gradle_startup = batched_experiment.estimate.ExperimentCostEstimator.measure_overheads(config)
+  timing_history = None
+  if os.path.exists(config.progress_file):
+    with open(config.progress_file, 'r') as f:
+      progress = json.load(f)
+    timing_history = progress['timing'] if 'timing' in progress else None
+  estimator = batched_experiment.estimate.ExperimentCostEstimator(
+    config, jvm_startup=jvm_startup, gradle_startup=gradle_startup, timing_history=timing_history
+  )
+  format_duration = batched_experiment.estimate.format_duration
+  print('JVM startup: {:.2f}s, Gradle startup: {:.2f}s'.format(jvm_startup, gradle_startup))
+  largest_batch = max(config.test_batches, key=len)
+  for runner_config in config.runner_configs:
+    print('{}: {} per repetition of a batch of {:d} tests (calibration {:.2f})'.format(
+      runner_config.name, format_duration(estimator.runner_estimate(runner_config, largest_batch)), len(largest_batch),
+      estimator.calibration(runner_config)
+    ))
+  print('{:d} batches, {:d} repetitions: {}'.format(
+    len(config.test_batches), config.repetitions, format_duration(estimator.experiment_estimate())
+  ))
 
 
 def main():
   parser = argparse.ArgumentParser()
   parser.add_argument('config', type=str)
+  parser.add_argument('--dry-run', action='store_true', help='estimate the wall time of the experiment and exit')
+  parser.add_argument('--worker', action='store_true', help='claim work items from the shared queue directory')
+  parser.add_argument('--worker-id', type=str, default=None)
+  parser.add_argument('--lease-timeout', type=int, default=600)
   args = parser.parse_args()
 
   config = batched_experiment.config.BatchedExperimentConfiguration.parse_from_file(args.config)
 
-  experiment_runner = batched_experiment.runner.ExperimentRunner(config)
+  if args.dry_run:
+    print_estimate(config)
+    return
+  if args.worker:
+    experiment_runner = batched_experiment.runner.ExperimentWorker(
+      config, worker_id=args.worker_id, lease_timeout=args.lease_timeout
+    )
+  else:
+    experiment_runner = batched_experiment.runner.ExperimentRunner(config)
   experiment_runner.run_experiment()
 
 
@@ -4,10 +4,14 @@ import csv
 import pickle
 
 
+from batched_experiment.experiment_data import Telemetry
+
+
 def main():
   parser = argparse.ArgumentParser()
   parser.add_argument('comparisons_file', type=str)
   parser.add_argument('output_file', type=str)
+  parser.add_argument('--hot-methods', type=str, default=None, help='write the hot method diffs to this CSV file')
   args = parser.parse_args()
 
   with open(args.comparisons_file, 'rb') as f:
@@ -35,9 +39,28 @@ def main():
     'alpha',
     'comparisons',
     'significant',
-    'p_value'
+    'p_value',
+    'top_hot_method'
+  ] + [
+    '{}_{}'.format(side, field) for side in ('baseline', 'comparison') for field in Telemetry.fields
+  ]
+  hot_method_columns = [
+    'baseline_class',
+    'baseline_test',
+    'comparison_class',
+    'comparison_test',
+    'config_name',
+    'rank',
+    'method',
+    'baseline_self_time',
+    'comparison_self_time',
+    'self_time_difference',
+    'baseline_total_time',
+    'comparison_total_time',
+    'total_time_difference'
   ]
   rows = []
+  hot_method_rows = []
   for result in comparison_results:
     baseline_result = result.baseline_results_combined
     baseline_statistics = result.baseline_statistics_combined
@@ -68,8 +91,33 @@ def main():
       'alpha': result.alpha,
       'comparisons': result.total_tests,
       'significant': result.significant_tests,
-      'p_value': result.binomial_test_result
+      'p_value': result.binomial_test_result,
+      'top_hot_method': None
     }
+    # Comparisons pickled before profiling was supported lack the attribute.
+    hot_method_diff = getattr(result, 'hot_method_diff', None)
+    if hot_method_diff:
+      row['top_hot_method'] = hot_method_diff[0].method
+    for rank, difference in enumerate(hot_method_diff or [], start=1):
+      hot_method_rows.append({
+        'baseline_class': baseline_result.test.class_name,
+        'baseline_test': baseline_result.test.method_name,
+        'comparison_class': comparison_result.test.class_name,
+        'comparison_test': comparison_result.test.method_name,
+        'config_name': baseline_result.runner.name,
+        'rank': rank,
+        'method': difference.method,
+        'baseline_self_time': difference.baseline_self_time,
+        'comparison_self_time': difference.comparison_self_time,
+        'self_time_difference': difference.self_time_difference,
+        'baseline_total_time': difference.baseline_total_time,
+        'comparison_total_time': difference.comparison_total_time,
+        'total_time_difference': difference.total_time_difference
+      })
+    for side, side_result in (('baseline', baseline_result), ('comparison', comparison_result)):
+      telemetry = side_result.result.telemetry
+      for field in Telemetry.fields:
+        row['{}_{}'.format(side, field)] = getattr(telemetry, field) if telemetry is not None else None
     rows.append(row)
 
   with open(args.output_file, 'w') as f:
@@ -77,6 +125,12 @@ def main():
     csv_writer.writeheader()
     csv_writer.writerows(rows)
 
+  if args.hot_methods is not None:
+    with open(args.hot_methods, 'w') as f:
+      csv_writer = csv.DictWriter(f, hot_method_columns, dialect=csv.unix_dialect)
+      csv_writer.writeheader()
+      csv_writer.writerows(hot_method_rows)
+
 
 if __name__ == '__main__':
   main()